@@ -0,0 +1,60 @@
+"""
+CPU ms and bytes saved compressing GET /imports/{import_id}/citizens bodies
+at several gzip levels (and brotli qualities, when brotli is installed)
+
+    PYTHONPATH=${PWD} python -m app.benchmarks.compression_benchmark 10000
+"""
+import sys
+import time
+from typing import List
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.compression import brotli, brotli_compressor, gzip_compressor
+from app.core.responses import TrustedJSONResponse, encode_citizens
+from app.models.citizen import validate_citizens_import
+
+REPEAT = 3
+GZIP_LEVELS = [1, 4, 6, 9]
+BROTLI_QUALITIES = [1, 4, 6]
+# streamed listings are compressed chunk by chunk
+CHUNK_SIZE = 64 * 1024
+
+
+def measure(make_compressor, level: int, body: bytes, chunk_size: int):
+    started = time.process_time()
+    for _ in range(REPEAT):
+        compressor = make_compressor(level)
+        size = sum(
+            len(compressor.compress(body[i : i + chunk_size]))
+            for i in range(0, len(body), chunk_size)
+        )
+        size += len(compressor.finish())
+    return (time.process_time() - started) / REPEAT * 1000, size
+
+
+def main(sizes: List[int]):
+    encodings = [("gzip", gzip_compressor, GZIP_LEVELS)]
+    if brotli is not None:
+        encodings.append(("br", brotli_compressor, BROTLI_QUALITIES))
+
+    print(
+        f"{'citizens':>10} {'encoding':>10} {'body KiB':>10} {'KiB':>8} "
+        f"{'ratio':>6} {'cpu ms':>8} {'streamed ms':>12}"
+    )
+    for size in sizes:
+        payload = {"citizens": generate_citizens_data(size, 4)}
+        citizens = validate_citizens_import(payload)
+        body = TrustedJSONResponse(encode_citizens(citizens)).body
+        for name, make_compressor, levels in encodings:
+            for level in levels:
+                ms, compressed = measure(make_compressor, level, body, len(body))
+                streamed_ms, _ = measure(make_compressor, level, body, CHUNK_SIZE)
+                print(
+                    f"{size:>10} {f'{name}-{level}':>10} {len(body) / 1024:>10.0f} "
+                    f"{compressed / 1024:>8.0f} {len(body) / compressed:>6.1f} "
+                    f"{ms:>8.1f} {streamed_ms:>12.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000])
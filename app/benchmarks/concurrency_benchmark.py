@@ -0,0 +1,83 @@
+"""
+latency of reads while large imports are being written, against a live server
+
+    PYTHONPATH=${PWD} SERVER_HOST=localhost SERVER_PORT=8000 \
+        python -m app.benchmarks.concurrency_benchmark 20000 8 4
+
+arguments are import size, readers and concurrent writers, run the server
+with several workers (uvicorn --workers 4) to stress cross-worker locking
+"""
+import sys
+import threading
+import time
+from typing import List
+
+import numpy
+import requests
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.tests.utils import get_server_api
+
+READ_ENDPOINTS = [
+    "/imports/{import_id}/citizens",
+    "/imports/{import_id}/citizens/birthdays",
+    "/imports/{import_id}/towns/stat/percentile/age",
+]
+
+
+def read_while(server_api: str, import_id: int, running: threading.Event) -> List[float]:
+    latencies = []
+    with requests.Session() as http:
+        while running.is_set():
+            for endpoint in READ_ENDPOINTS:
+                started = time.perf_counter()
+                http.get(f"{server_api}{endpoint.format(import_id=import_id)}")
+                latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main(import_size: int = 20000, readers: int = 8, writers: int = 1):
+    server_api = get_server_api()
+    small_import = {"citizens": generate_citizens_data(100)}
+    large_import = {"citizens": generate_citizens_data(import_size, 10)}
+    import_id = requests.post(f"{server_api}/imports", json=small_import).json()
+    import_id = import_id["data"]["import_id"]
+
+    running = threading.Event()
+    running.set()
+    results = [[] for _ in range(readers)]
+
+    def reader(number: int):
+        results[number] = read_while(server_api, import_id, running)
+
+    import_statuses = []
+
+    def writer():
+        response = requests.post(f"{server_api}/imports", json=large_import)
+        import_statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    writer_threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    import_time = time.perf_counter() - started
+    running.clear()
+    for thread in threads:
+        thread.join()
+
+    latencies = numpy.array([l for result in results for l in result]) * 1000
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+    failed = sum(status != 200 for status in import_statuses)
+    print(f"{writers} imports of {import_size} citizens took {import_time:.2f}s")
+    print(f"{failed} of them failed")
+    print(f"{len(latencies)} reads by {readers} readers meanwhile")
+    print(f"p50 {p50:.1f}ms  p95 {p95:.1f}ms  p99 {p99:.1f}ms  max {latencies.max():.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,35 @@
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List
+
+
+def generate_citizens_data(
+    size: int, relatives_per_citizen: int = 2, towns: int = 100, seed: int = None
+) -> List[Dict]:
+    # payload of POST /imports, relatives are symmetric and their number
+    # per citizen is relatives_per_citizen on average
+    rnd = random.Random(size if seed is None else seed)
+    relatives = defaultdict(set)
+    for citizen_id in range(1, size + 1):
+        for _ in range(relatives_per_citizen // 2):
+            relative_id = rnd.randint(1, size)
+            if relative_id != citizen_id:
+                relatives[citizen_id].add(relative_id)
+                relatives[relative_id].add(citizen_id)
+    return [
+        {
+            "citizen_id": citizen_id,
+            "town": f"Город {rnd.randrange(towns)}",
+            "street": "Льва Толстого",
+            "building": "16к7стр5",
+            "apartment": citizen_id,
+            "name": "Иванов Иван Иванович",
+            "birth_date": (date(1950, 1, 1) + timedelta(rnd.randint(0, 20000))).strftime(
+                "%d.%m.%Y"
+            ),
+            "gender": rnd.choice(("male", "female")),
+            "relatives": sorted(relatives[citizen_id]),
+        }
+        for citizen_id in range(1, size + 1)
+    ]
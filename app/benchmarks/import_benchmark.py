@@ -0,0 +1,96 @@
+"""
+rows/sec of POST /imports storage path: legacy per-row ORM vs bulk executemany
+
+    PYTHONPATH=${PWD} python -m app.benchmarks.import_benchmark 1000 10000 100000
+
+set BENCHMARK_DATABASE_URL to benchmark e.g. a postgresql database instead of
+a scratch sqlite file, its tables are DROPPED after every run
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.crud.citizen import add_relation, import_users
+from app.db.base import Base
+from app.db_models.citizen import Citizen, Import
+from app.models.citizen import validate_citizens_import
+
+
+def generate_citizens(size: int, relatives_per_citizen: int = 2) -> List[Dict]:
+    payload = {"citizens": generate_citizens_data(size, relatives_per_citizen)}
+    return validate_citizens_import(payload)
+
+
+def legacy_import_users(db: Session, citizens: List[Dict]) -> Import:
+    inverted_inserted_relations = defaultdict(list)
+
+    db_users_import = Import()
+    db.add(db_users_import)
+    db.commit()
+    db.refresh(db_users_import)
+    for citizen in citizens:
+        db_citizen = Citizen(
+            import_id=db_users_import.import_id,
+            citizen_id=citizen["citizen_id"],
+            town=citizen["town"],
+            street=citizen["street"],
+            building=citizen["building"],
+            apartment=citizen["apartment"],
+            name=citizen["name"],
+            birth_date=citizen["birth_date"],
+            gender=citizen["gender"],
+        )
+
+        for relative_citizen_id in citizen["relatives"]:
+            if relative_citizen_id in inverted_inserted_relations[citizen["citizen_id"]]:
+                continue
+            add_relation(
+                db, db_users_import.import_id, citizen["citizen_id"], relative_citizen_id
+            )
+            inverted_inserted_relations[relative_citizen_id].append(
+                citizen["citizen_id"]
+            )
+        db.add(db_citizen)
+    db.commit()
+
+    return db_users_import
+
+
+def measure(import_func, citizens: List[Dict]) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = os.environ.get(
+            "BENCHMARK_DATABASE_URL", f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        )
+        engine = create_engine(database_url)
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        try:
+            started = time.perf_counter()
+            import_func(db, citizens)
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+            Base.metadata.drop_all(bind=engine)
+            engine.dispose()
+    return elapsed
+
+
+def main(sizes: List[int]):
+    print(f"{'citizens':>10} {'rows':>10} {'legacy rows/s':>15} {'bulk rows/s':>15}")
+    for size in sizes:
+        citizens = generate_citizens(size)
+        rows = size + sum(len(c["relatives"]) for c in citizens)
+        legacy = measure(legacy_import_users, citizens)
+        bulk = measure(import_users, citizens)
+        print(f"{size:>10} {rows:>10} {rows / legacy:>15.0f} {rows / bulk:>15.0f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
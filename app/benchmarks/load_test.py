@@ -0,0 +1,280 @@
+"""
+load test of all five endpoints on synthetic imports
+
+in-process through the ASGI app (uses the db configured by DATABASE_URL):
+    PYTHONPATH=${PWD} python -m app.benchmarks.load_test --citizens 10000
+
+over HTTP against a live server:
+    PYTHONPATH=${PWD} SERVER_HOST=localhost SERVER_PORT=8000 \
+        python -m app.benchmarks.load_test --http --concurrency 16
+
+every run is stored as bench_results/<time>-<commit>.json, compare two runs:
+    python -m app.benchmarks.load_test --compare old.json new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy
+import requests
+
+from app.benchmarks.datagen import generate_citizens_data
+
+Request = Tuple[str, str, dict]  # method, path, json body
+
+READ_ENDPOINTS = {
+    "get_citizens": "/imports/{import_id}/citizens",
+    "get_presents": "/imports/{import_id}/citizens/birthdays",
+    "get_age_stats": "/imports/{import_id}/towns/stat/percentile/age",
+}
+
+
+class ASGIClient:
+    # just enough of an HTTP client to call the app without a server
+    def __init__(self, concurrency: int):
+        from app.main import app
+
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.loop.run_until_complete(app.router.lifespan.startup())
+
+    async def _request(
+        self, method: str, path: str, body: dict, response_body: list = None
+    ) -> Tuple[int, float]:
+        body = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"bench"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("bench", 0),
+            "server": ("bench", 80),
+        }
+        request_messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = []
+
+        async def receive() -> dict:
+            if request_messages:
+                return request_messages.pop()
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            elif response_body is not None:
+                response_body.append(message.get("body", b""))
+
+        async with self.semaphore:
+            started = time.perf_counter()
+            await self.app(scope, receive, send)
+            return status[0], time.perf_counter() - started
+
+    async def _gather(self, requests_to_send: List[Request]) -> List[Tuple[int, float]]:
+        return await asyncio.gather(
+            *(self._request(*request) for request in requests_to_send)
+        )
+
+    def run(self, requests_to_send: List[Request]) -> List[Tuple[int, float]]:
+        return self.loop.run_until_complete(self._gather(requests_to_send))
+
+    def post_import(self, payload: dict) -> Tuple[int, float, int]:
+        response_body = []
+        status, latency = self.loop.run_until_complete(
+            self._request("POST", "/imports", payload, response_body)
+        )
+        import_id = json.loads(b"".join(response_body))["data"]["import_id"]
+        return status, latency, import_id
+
+
+class HTTPClient:
+    def __init__(self, concurrency: int):
+        from app.tests.utils import get_server_api
+
+        self.server_api = get_server_api()
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+
+    def _request(self, request: Request) -> Tuple[int, float]:
+        method, path, body = request
+        started = time.perf_counter()
+        response = self.session.request(method, f"{self.server_api}{path}", json=body)
+        return response.status_code, time.perf_counter() - started
+
+    def run(self, requests_to_send: List[Request]) -> List[Tuple[int, float]]:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self._request, requests_to_send))
+
+    def post_import(self, payload: dict) -> Tuple[int, float, int]:
+        started = time.perf_counter()
+        response = self.session.post(f"{self.server_api}/imports", json=payload)
+        latency = time.perf_counter() - started
+        return response.status_code, latency, response.json()["data"]["import_id"]
+
+
+def summarize(results: List[Tuple[int, float]], wall_time: float) -> Dict:
+    latencies = numpy.array([latency for _, latency in results]) * 1000
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(results),
+        "errors": sum(status >= 400 for status, _ in results),
+        "throughput_rps": round(len(results) / wall_time, 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+    }
+
+
+def measure(client, requests_to_send: List[Request]) -> Dict:
+    started = time.perf_counter()
+    results = client.run(requests_to_send)
+    return summarize(results, time.perf_counter() - started)
+
+
+def patch_requests(
+    import_id: int, citizens: int, count: int, relatives: int, rnd: random.Random
+) -> List[Request]:
+    patches = []
+    for _ in range(count):
+        citizen_id = rnd.randint(1, citizens)
+        patch = {"name": f"Иванов Иван {rnd.randint(0, 10 ** 6)}"}
+        if relatives:
+            candidates = rnd.sample(range(1, citizens + 1), min(relatives, citizens))
+            patch["relatives"] = [c for c in candidates if c != citizen_id]
+        path = f"/imports/{import_id}/citizens/{citizen_id}"
+        patches.append(("PATCH", path, patch))
+    return patches
+
+
+def run(args: argparse.Namespace) -> Dict:
+    client = (HTTPClient if args.http else ASGIClient)(args.concurrency)
+    rnd = random.Random(args.seed)
+    payload = {
+        "citizens": generate_citizens_data(
+            args.citizens, args.relatives, args.towns, args.seed
+        )
+    }
+    results = {}
+
+    # imports are heavy and mostly serialized by the db, so they go one by one
+    imports = [client.post_import(payload) for _ in range(args.imports)]
+    results["post_imports"] = summarize(
+        [(status, latency) for status, latency, _ in imports],
+        sum(latency for _, latency, _ in imports),
+    )
+    import_id = imports[-1][2]
+
+    for name, endpoint in READ_ENDPOINTS.items():
+        path = endpoint.format(import_id=import_id)
+        results[name] = measure(client, [("GET", path, None)] * args.requests)
+
+    patches = patch_requests(
+        import_id, args.citizens, args.requests, args.relatives, rnd
+    )
+    results["patch_citizen"] = measure(client, patches)
+    return results
+
+
+def current_commit() -> str:
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return output.decode().strip()
+
+
+def save(args: argparse.Namespace, results: Dict) -> str:
+    commit = current_commit()
+    started_at = datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{started_at}-{commit}.json")
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "params": params, "results": results}, f, indent=2)
+    return path
+
+
+def print_results(results: Dict):
+    print(f"{'endpoint':<16} {'rps':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'errors':>7}")
+    for name, r in results.items():
+        print(
+            f"{name:<16} {r['throughput_rps']:>10} {r['p50_ms']:>10} "
+            f"{r['p95_ms']:>10} {r['p99_ms']:>10} {r['errors']:>7}"
+        )
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"{'endpoint':<16} {'rps':>18} {'p99 ms':>22}")
+
+    def change(old_value: float, new_value: float) -> str:
+        if not old_value:
+            return "n/a"
+        return f"{(new_value - old_value) / old_value * 100:+.1f}%"
+
+    for name, new_r in new["results"].items():
+        old_r = old["results"].get(name)
+        if old_r is None:
+            continue
+        rps = change(old_r["throughput_rps"], new_r["throughput_rps"])
+        p99 = change(old_r["p99_ms"], new_r["p99_ms"])
+        print(
+            f"{name:<16} {new_r['throughput_rps']:>10} {rps:>7} "
+            f"{new_r['p99_ms']:>14} {p99:>7}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--http", action="store_true", help="go through a server")
+    parser.add_argument("--citizens", type=int, default=10000)
+    parser.add_argument("--towns", type=int, default=100)
+    parser.add_argument("--relatives", type=int, default=4, help="per citizen")
+    parser.add_argument("--imports", type=int, default=3, help="POST /imports runs")
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args)
+    print_results(results)
+    print(f"saved to {save(args, results)}")
+
+
+if __name__ == "__main__":
+    main()
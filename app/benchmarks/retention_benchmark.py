@@ -0,0 +1,107 @@
+"""
+read latency of one import as the number of imports kept in the db grows,
+then the cost of purging all but the last one in batches and the file size
+given back by incremental vacuum (sqlite, cache off)
+
+    PYTHONPATH=${PWD} python -m app.benchmarks.retention_benchmark 1000 1 10 100 400
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    get_age_stats_by_town,
+    get_citizens_data,
+    get_citizens_presents,
+    import_users,
+)
+from app.crud.import_retention import delete_import, purge_import_batch, reclaim_space
+from app.db.init_db import init_db
+from app.models.citizen import validate_citizens_import
+
+REPEAT = 7
+BATCH_SIZE = 5000
+VACUUM_PAGES = 256
+
+
+def median_ms(func: Callable[[], object]) -> float:
+    durations = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main(citizens: int, import_counts: List[int]):
+    import_cache.max_size = 0
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "retention.db")
+    engine = create_engine(f"sqlite:///{path}")
+    init_db(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    payload = {"citizens": generate_citizens_data(citizens, 4)}
+
+    print(
+        f"{'imports':>8} {'db MiB':>8} {'citizens ms':>12} "
+        f"{'birthdays ms':>13} {'age stats ms':>13}"
+    )
+    import_ids = []
+    for count in import_counts:
+        while len(import_ids) < count:
+            citizens_data = validate_citizens_import(
+                {"citizens": [dict(citizen) for citizen in payload["citizens"]]}
+            )
+            import_ids.append(import_users(db, citizens_data).import_id)
+        last = import_ids[-1]
+        print(
+            f"{count:>8} {os.path.getsize(path) / 2 ** 20:>8.1f} "
+            f"{median_ms(lambda: get_citizens_data(db, last)):>12.1f} "
+            f"{median_ms(lambda: get_citizens_presents(db, last)):>13.1f} "
+            f"{median_ms(lambda: get_age_stats_by_town(db, last)):>13.1f}"
+        )
+
+    for import_id in import_ids[:-1]:
+        delete_import(db, import_id)
+    batches = []
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        if purge_import_batch(db, BATCH_SIZE) is None:
+            break
+        batches.append(time.perf_counter() - batch_started)
+    purge_time = time.perf_counter() - started
+    size = os.path.getsize(path)
+    started = time.perf_counter()
+    while reclaim_space(db, VACUUM_PAGES):
+        pass
+    vacuum_time = time.perf_counter() - started
+
+    last = import_ids[-1]
+    print(
+        f"\npurged {len(import_ids) - 1} imports in {len(batches)} batches "
+        f"of {BATCH_SIZE} rows: {purge_time:.1f}s, "
+        f"longest batch {max(batches, default=0) * 1000:.0f}ms"
+    )
+    print(
+        f"incremental vacuum: {size / 2 ** 20:.1f} -> "
+        f"{os.path.getsize(path) / 2 ** 20:.1f} MiB in {vacuum_time:.1f}s"
+    )
+    print(
+        f"citizens of the kept import: "
+        f"{median_ms(lambda: get_citizens_data(db, last)):.1f}ms"
+    )
+    db.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 1000, args[1:] or [1, 10, 100, 400])
@@ -0,0 +1,61 @@
+"""
+ms to turn GET /imports/{import_id}/citizens data into a response body:
+response_model validation + stdlib json vs TrustedJSONResponse
+
+    PYTHONPATH=${PWD} python -m app.benchmarks.serialization_benchmark 10000
+"""
+import sys
+import time
+from typing import Callable, Dict, List
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_cloned_field
+from pydantic.fields import Field
+from starlette.responses import JSONResponse
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.responses import TrustedJSONResponse, encode_citizens
+from app.models.citizen import CitizensGetOut, validate_citizens_import
+
+REPEAT = 5
+
+
+def response_model_field() -> Field:
+    # what FastAPI builds for response_model=CitizensGetOut
+    field = Field(
+        name="Response",
+        type_=CitizensGetOut,
+        class_validators={},
+        model_config=CitizensGetOut.Config,
+        required=False,
+    )
+    return create_cloned_field(field)
+
+
+def measure(render: Callable[[List[Dict]], bytes], citizens: List[Dict]) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        render(citizens)
+    return (time.perf_counter() - started) / REPEAT * 1000
+
+
+def main(sizes: List[int]):
+    field = response_model_field()
+
+    def response_model(citizens: List[Dict]) -> bytes:
+        content = serialize_response(field=field, response={"data": citizens})
+        return JSONResponse(content).body
+
+    def trusted(citizens: List[Dict]) -> bytes:
+        return TrustedJSONResponse(encode_citizens(citizens)).body
+
+    print(f"{'citizens':>10} {'response_model ms':>18} {'trusted ms':>12}")
+    for size in sizes:
+        payload = {"citizens": generate_citizens_data(size, 4)}
+        citizens = validate_citizens_import(payload)
+        slow, fast = measure(response_model, citizens), measure(trusted, citizens)
+        print(f"{size:>10} {slow:>18.1f} {fast:>12.1f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000])
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Tuple
+
+from app.core.config import config
+from app.core.metrics import observe_cache_lookup
+
+
+class ImportCache:
+    # LRU of values derived from one import, every entry is stamped with the
+    # import version it was computed for, so entries computed by this worker
+    # are never served after another worker has patched the import
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = Lock()
+
+    def get(self, import_id: int, key: Hashable, version: int) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get((import_id, key))
+            hit = entry is not None and entry[0] == version
+            if hit:
+                self._entries.move_to_end((import_id, key))
+                self.hits += 1
+            else:
+                self.misses += 1
+        observe_cache_lookup(key, hit)
+        return (True, entry[1]) if hit else (False, None)
+
+    def set(self, import_id: int, key: Hashable, version: int, value: Any):
+        with self._lock:
+            self._entries[(import_id, key)] = (version, value)
+            self._entries.move_to_end((import_id, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, import_id: int):
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == import_id]:
+                del self._entries[entry_key]
+
+    def values(self, key: Hashable) -> List[Any]:
+        # values cached under `key` for any import and version
+        with self._lock:
+            return [v for (_, k), (_, v) in self._entries.items() if k == key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+import_cache = ImportCache(config.cache_size)
@@ -0,0 +1,160 @@
+import asyncio
+import zlib
+from typing import Callable, Dict, NamedTuple, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# bigger bodies are compressed in the default executor: zlib and brotli
+# release the GIL, so the event loop keeps serving other requests
+EXECUTOR_SIZE = 64 * 1024
+
+
+class Compressor(NamedTuple):
+    compress: Callable[[bytes], bytes]
+    finish: Callable[[], bytes]
+
+
+def gzip_compressor(level: int) -> Compressor:
+    # wbits 16 + 15: gzip header and trailer around deflate
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return Compressor(compressor.compress, compressor.flush)
+
+
+def brotli_compressor(quality: int) -> Compressor:
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+    return Compressor(compressor.process, compressor.finish)
+
+
+def supported_encodings() -> Dict[str, Callable[[int], Compressor]]:
+    # in order of preference when a client accepts several equally
+    encodings = {}
+    if brotli is not None:
+        encodings["br"] = brotli_compressor
+    encodings["gzip"] = gzip_compressor
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, supported) -> Optional[str]:
+    # the supported coding with the highest q value, None for identity
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding] = q
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    # like starlette's GZipMiddleware, but negotiates brotli as well,
+    # has a compression level and doesn't block the loop on big bodies
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 4,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+        self.encodings = supported_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            encoding = negotiate_encoding(
+                headers.get("Accept-Encoding", ""), self.encodings
+            )
+            if encoding is not None:
+                compressor = self.encodings[encoding](self.levels[encoding])
+                responder = CompressionResponder(
+                    self.app, encoding, compressor, self.minimum_size
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(
+        self, app: ASGIApp, encoding: str, compressor: Compressor, minimum_size: int
+    ):
+        self.app = app
+        self.encoding = encoding
+        self.compressor = compressor
+        self.minimum_size = minimum_size
+        self.send = None
+        self.initial_message = {}
+        self.started = False
+        # False once the response turns out not worth or not fit for compressing
+        self.compressing = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def run(self, func: Callable, *args) -> bytes:
+        if args and len(args[0]) >= EXECUTOR_SIZE:
+            return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+        return func(*args)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            # headers are sent along with the first body, when it's known
+            # whether and how the response is compressed
+            self.initial_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            if "content-encoding" in headers or (
+                len(body) < self.minimum_size and not more_body
+            ):
+                self.compressing = False
+            else:
+                headers["Content-Encoding"] = self.encoding
+                headers.add_vary_header("Accept-Encoding")
+                # a streamed response's size is unknown until it ends
+                del headers["Content-Length"]
+            if self.compressing and not more_body:
+                body = await self.run(self.compressor.compress, body)
+                body += self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                message["body"] = body
+            elif self.compressing:
+                message["body"] = await self.run(self.compressor.compress, body)
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if self.compressing:
+            body = await self.run(self.compressor.compress, body)
+            if not more_body:
+                body += self.compressor.finish()
+            message["body"] = body
+        await self.send(message)
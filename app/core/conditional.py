@@ -0,0 +1,67 @@
+import re
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+
+# GET endpoints whose responses depend only on the import's data,
+# the age stats also depend on today's date
+CONDITIONAL_PATH_RE = re.compile(
+    r"^/imports/(\d+)/(citizens|citizens/birthdays|towns/stat/percentile/age)$"
+)
+DAILY_RESOURCE = "towns/stat/percentile/age"
+
+
+def conditional_resource(path: str) -> Optional[Tuple[int, str]]:
+    match = CONDITIONAL_PATH_RE.match(path)
+    if match is None:
+        return None
+    return int(match.group(1)), match.group(2)
+
+
+def make_etag(import_id: int, version: int, today: Optional[date] = None) -> str:
+    # weak: gzip and the fast/plain encoders give different bytes
+    # for the same data
+    tag = f"{import_id}-{version}"
+    if today is not None:
+        tag += f"-{today.isoformat()}"
+    return f'W/"{tag}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as If-None-Match requires
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def http_date(value: datetime) -> str:
+    # naive datetimes from the db are utc
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def is_settled(updated_at: datetime, now: datetime) -> bool:
+    # http dates have whole seconds only: another change within the second
+    # of updated_at would get the same Last-Modified, so it is sent only
+    # once that second is over
+    return updated_at.replace(microsecond=0) < now.replace(microsecond=0)
+
+
+def not_modified_since(if_modified_since: str, updated_at: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since is None:
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # whole seconds are enough for a Last-Modified that is_settled
+    modified = updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+    return modified <= since
@@ -7,6 +7,74 @@ class Settings(BaseSettings):
     server_port: int = None
 
     database_url = "sqlite:///./app.db"
+    # connection pool, used by client-server databases only (e.g. postgresql)
+    db_pool_size: int = 8
+    db_max_overflow: int = 8
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 3600
+
+    # "production" turns on WAL, the pragmas below and serialized writers
+    sqlite_profile: str = "default"
+    sqlite_busy_timeout: int = 30000  # ms
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_cache_size_kib: int = 64 * 1024
+
+    # rows per executemany batch on POST /imports
+    import_chunk_size: int = 5000
+    # parse POST /imports body as it arrives, validating and writing citizens
+    # in import_chunk_size batches, instead of loading the whole body first
+    stream_imports: bool = False
+    # seconds a streamed import waits for the next chunk of its body, it may
+    # hold the write lock meanwhile; a client slower than that gets 408
+    stream_read_timeout: float = 10
+    # answer POST /imports with 202 and a job to poll at /imports/jobs/{job_id},
+    # validating in import_job_processes processes (stream_imports is ignored)
+    import_jobs: bool = False
+    import_job_processes: int = 2
+    # POST /imports of citizens already imported (and not PATCHed since), or
+    # with an Idempotency-Key header seen before, returns the existing import
+    dedupe_imports: bool = False
+    # imports older than that many days are deleted, 0 keeps them forever
+    import_retention_days: float = 0
+    # deleted imports are purged by a background thread in transactions of
+    # purge_batch_size rows, checking for expired ones every purge_interval s
+    purge_batch_size: int = 5000
+    purge_interval: float = 60
+    # sqlite pages given back to the file system after every batch
+    vacuum_pages: int = 1000
+    # keep the citizens of every import in a sqlite file of its own in this
+    # directory: imports are written in parallel and a purged import is
+    # a file unlink; imports stored in database_url before aren't moved
+    sqlite_shards_dir: str = None
+    # entries in the per-import cache of GET results, 0 disables it
+    cache_size: int = 256
+    # stream GET /imports/{import_id}/citizens instead of building it in memory
+    stream_citizens: bool = False
+    stream_batch_size: int = 1000
+    # serve GET endpoints from a columnar in-memory snapshot of an import,
+    # kept in the cache above and patched by PATCH requests
+    snapshot_reads: bool = False
+    # return crud results without validating them against response models
+    # again and encode them with ujson, the OpenAPI schema stays the same
+    fast_responses: bool = False
+    # compress responses of at least compress_minimum_size bytes with gzip,
+    # or brotli when it's installed and the client accepts it
+    compress_responses: bool = False
+    compress_minimum_size: int = 1024
+    gzip_level: int = 4
+    brotli_quality: int = 4
+    # count sql statements and time the db, validation and serialization of
+    # every request, reported in its Server-Timing header
+    instrumentation: bool = False
+    # write stacks of requests slower than profile_slow_request_ms, sampled
+    # every profile_interval_ms, to profile_dir in the folded flamegraph format
+    profile_slow_request_ms: int = 0
+    profile_interval_ms: float = 5
+    profile_dir: str = "profiles"
+    # request, import, db pool and cache metrics on GET /metrics
+    metrics: bool = False
+    # threads per worker running db-bound handlers
+    db_threads: int = 8
 
     class Config:
         env_prefix = ""
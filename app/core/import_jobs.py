@@ -0,0 +1,137 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core import config
+from app.crud.citizen import import_users_in_batches
+from app.crud.import_digest import (
+    IdempotencyKeyReusedError,
+    KeyContent,
+    import_once,
+    request_digests,
+)
+from app.crud.import_job import set_import_job_progress, update_import_job
+from app.db.session import Session, import_write_lock, side_bind, write_lock
+from app.models.citizen import ImportValidationError, validate_citizens_import_body
+
+logger = logging.getLogger(__name__)
+
+# ImportJob.worker of the jobs run by this process
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+# bodies are parsed and validated in parallel by worker processes, started
+# with the first job, validated imports are written one by one by a single
+# thread
+_validators: Optional[ProcessPoolExecutor] = None
+_validators_lock = threading.Lock()
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import-writer")
+
+# citizens written so far by imports running in this process, without
+# side_bind only: the db sees them once the import's transaction commits
+import_progress: Dict[int, int] = {}
+
+
+def _tracked(
+    job_id: int, batches: List[Tuple[List[Dict], List[Tuple[int, int]]]]
+) -> Iterator[Tuple[List[Dict], List[Tuple[int, int]]]]:
+    citizens_done = 0
+    for citizens, relations in batches:
+        yield citizens, relations
+        citizens_done += len(citizens)
+        if side_bind is not None:
+            set_import_job_progress(side_bind, job_id, citizens_done)
+        else:
+            import_progress[job_id] = citizens_done
+
+
+def _write(job_id: int, validation: Future, idempotency_key: Optional[str]):
+    db = Session()
+    try:
+        try:
+            batches = validation.result()
+        except ImportValidationError as e:
+            with write_lock():
+                update_import_job(db, job_id, status="failed", error=str(e))
+            return
+        total = sum(len(citizens) for citizens, _ in batches)
+        all_citizens = None
+        if config.dedupe_imports:
+            all_citizens = [citizen for citizens, _ in batches for citizen in citizens]
+        digests = request_digests(all_citizens, idempotency_key)
+        with import_write_lock():
+            update_import_job(db, job_id, status="importing", citizens_total=total)
+            db_import = import_once(
+                db,
+                digests,
+                lambda: import_users_in_batches(db, _tracked(job_id, batches)),
+                lambda: KeyContent(all_citizens).hexdigest(),
+            )
+            update_import_job(
+                db,
+                job_id,
+                status="done",
+                citizens_done=total,
+                import_id=db_import.import_id,
+            )
+    except IdempotencyKeyReusedError as e:
+        db.rollback()
+        with write_lock():
+            update_import_job(db, job_id, status="failed", error=str(e))
+    except Exception:
+        logger.exception("import job %s failed", job_id)
+        db.rollback()
+        with write_lock():
+            update_import_job(db, job_id, status="failed", error="internal error")
+    finally:
+        import_progress.pop(job_id, None)
+        db.close()
+
+
+def _get_validators() -> ProcessPoolExecutor:
+    global _validators
+    with _validators_lock:
+        if _validators is None:
+            _validators = ProcessPoolExecutor(
+                max_workers=config.import_job_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _validators
+
+
+def submit_import_job(job_id: int, body: bytes, idempotency_key: Optional[str] = None):
+    validation = _get_validators().submit(
+        validate_citizens_import_body, body, config.import_chunk_size
+    )
+    validation.add_done_callback(
+        lambda future: _writer.submit(_write, job_id, future, idempotency_key)
+    )
+
+
+def is_running_job_worker(worker: Optional[str]) -> bool:
+    # whether the process of ImportJob.worker may still run its jobs: jobs of
+    # other hosts are left to them, a pid reused by this process is a restart
+    if worker is None:
+        return False
+    host, pid = worker.rsplit(":", 1)
+    if host != socket.gethostname():
+        return True
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def shutdown_import_jobs():
+    # accepted jobs are finished, not dropped
+    if _validators is not None:
+        _validators.shutdown(wait=True)
+    _writer.shutdown(wait=True)
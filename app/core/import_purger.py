@@ -0,0 +1,65 @@
+import logging
+import threading
+from datetime import timedelta
+
+from app.core import config
+from app.crud.import_retention import expire_imports, purge_import_batch, reclaim_space
+from app.db.session import Session, write_lock
+
+logger = logging.getLogger(__name__)
+
+
+class ImportPurger:
+    # a thread expiring imports every purge_interval and purging deleted ones
+    # batch by batch, holding the write lock for one batch at a time, so
+    # imports and PATCHes get in between
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="import-purger", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("purging imports failed")
+            self._wake.wait(config.purge_interval)
+            self._wake.clear()
+
+    def run_once(self) -> int:
+        # rows purged
+        db = Session()
+        try:
+            if config.import_retention_days:
+                retention = timedelta(days=config.import_retention_days)
+                with write_lock():
+                    expire_imports(db, retention)
+            purged = 0
+            while not self._stopped:
+                with write_lock():
+                    deleted = purge_import_batch(db, config.purge_batch_size)
+                    reclaimed = reclaim_space(db, config.vacuum_pages)
+                if deleted is None and reclaimed < config.vacuum_pages:
+                    return purged
+                purged += deleted or 0
+            return purged
+        finally:
+            db.close()
+
+
+import_purger = ImportPurger()
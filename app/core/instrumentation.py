@@ -0,0 +1,181 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.phases: Dict[str, float] = {}
+        # set when a handler hands its data over to FastAPI for response_model
+        # validation and encoding, which are then counted as serialization
+        self.handler_done: Optional[float] = None
+        # threads that did some of the request's work, for the profiler
+        self.threads: Set[int] = {threading.get_ident()}
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.started
+        metrics = [f'db;dur={self.db_time * 1000:.1f};desc="{self.statements} sql"']
+        metrics += [
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()
+        ]
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+# copied into the tasks and threadpool calls serving the request,
+# all of them share the same RequestMetrics
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+def start_request() -> RequestMetrics:
+    metrics = RequestMetrics()
+    _current.set(metrics)
+    return metrics
+
+
+@contextmanager
+def phase(name: str):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics.threads.add(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(name, time.perf_counter() - started)
+
+
+def handler_done():
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.handler_done = time.perf_counter()
+
+
+def instrument_engine(engine: Engine):
+    # time of the cursor executing statements, rows are fetched later
+    # and that time is counted by whoever fetches them
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        # one value, not a stack: a statement that raises never gets to
+        # after_cursor_execute, its start time is just overwritten
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, params, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"]
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.statements += 1
+            metrics.db_time += elapsed
+            metrics.threads.add(threading.get_ident())
+
+
+class StackSampler:
+    # samples the stacks of all threads every `interval` seconds and keeps
+    # the last `max_samples` of them, so stacks of a slow request can be
+    # picked once it's known to be slow
+    def __init__(self, interval: float, max_samples: int = 100_000):
+        self.interval = interval
+        self.samples: Deque[Tuple[float, int, str]] = deque(maxlen=max_samples)
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.samples.append((now, ident, self._fold(frame)))
+
+    @staticmethod
+    def _fold(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def folded(self, threads: Set[int], since: float) -> List[str]:
+        # "root;...;leaf count" lines, the input of flamegraph.pl and speedscope;
+        # a thread may have served another request in between, its stacks
+        # are then included as well
+        stacks = Counter(
+            stack
+            for sampled, ident, stack in list(self.samples)
+            if sampled >= since and ident in threads
+        )
+        return [f"{stack} {count}" for stack, count in stacks.most_common()]
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold: float, interval: float, directory: str):
+        self.threshold = threshold
+        self.directory = directory
+        self.sampler = StackSampler(interval)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+
+    def finish(self, metrics: RequestMetrics, method: str, path: str):
+        duration = time.perf_counter() - metrics.started
+        if duration < self.threshold:
+            return
+        lines = self.sampler.folded(metrics.threads, metrics.started)
+        name = "-".join(
+            [
+                time.strftime("%Y%m%d-%H%M%S"),
+                f"{duration * 1000:.0f}ms",
+                method,
+                path.strip("/").replace("/", "_") or "root",
+            ]
+        )
+        file_path = os.path.join(self.directory, f"{name}.folded")
+        with open(file_path, "w") as folded_file:
+            folded_file.writelines(f"{line}\n" for line in lines)
+        logger.warning(
+            "%s %s took %.0fms, %s sql: stacks in %s",
+            method,
+            path,
+            duration * 1000,
+            metrics.statements,
+            file_path,
+        )
+
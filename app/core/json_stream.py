@@ -0,0 +1,169 @@
+import codecs
+import json
+from typing import Iterable, Iterator, List
+
+# a single array item is never buffered past this size waiting for its end
+MAX_ITEM_SIZE = 1024 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONArrayStream:
+    # incremental parser of `{"<key>": [item, ...], ...}`: fed with chunks
+    # of the document, it returns items of the array as soon as they are
+    # complete, so only the not yet parsed tail of the document is kept
+    def __init__(self, key: str):
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.consumed = 0  # characters dropped from the head of the buffer
+        self.state = "start"
+        self.current_key = None
+        self.key_found = False
+        # a value not complete yet is decoded again only once the pending
+        # text has doubled, so a long one isn't rescanned on every chunk
+        self.retry_size = 0
+
+    def _skip_whitespace(self):
+        buffer = self.buffer
+        while self.position < len(buffer) and buffer[self.position] in WHITESPACE:
+            self.position += 1
+
+    def _expect(self, expected: str) -> str:
+        self._skip_whitespace()
+        if self.position == len(self.buffer):
+            return ""
+        char = self.buffer[self.position]
+        if char not in expected:
+            raise JSONStreamError(
+                f"{' or '.join(expected)} expected at {self._offset()}, got {char!r}"
+            )
+        self.position += 1
+        return char
+
+    def _decode_value(self, final: bool, max_size: float = MAX_ITEM_SIZE):
+        # a value is taken only once something follows it, otherwise
+        # a number cut by a chunk boundary would be decoded as a shorter one
+        self._skip_whitespace()
+        pending = len(self.buffer) - self.position
+        if pending < self.retry_size and not final:
+            return False, None
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.position)
+        except json.JSONDecodeError as e:
+            if final or pending > max_size:
+                raise JSONStreamError(f"invalid json at {self._offset()}: {e.msg}")
+            self.retry_size = 2 * pending
+            return False, None
+        if end == len(self.buffer) and not final:
+            self.retry_size = pending + 1
+            return False, None
+        self.position = end
+        self.retry_size = 0
+        return True, value
+
+    def _offset(self) -> int:
+        return self.consumed + self.position
+
+    def _parse(self, final: bool) -> List:
+        items = []
+        while True:
+            if self.state == "start":
+                if not self._expect("{"):
+                    break
+                self.state = "key_or_end"
+            elif self.state in ("key_or_end", "key"):
+                self._skip_whitespace()
+                if self.position == len(self.buffer):
+                    break
+                if self.state == "key_or_end" and self.buffer[self.position] == "}":
+                    self.position += 1
+                    self.state = "done"
+                    continue
+                decoded, key = self._decode_value(final)
+                if not decoded:
+                    break
+                if type(key) is not str:
+                    raise JSONStreamError(f"object key expected at {self._offset()}")
+                self.current_key = key
+                self.state = "colon"
+            elif self.state == "colon":
+                if not self._expect(":"):
+                    break
+                if self.current_key == self.key:
+                    if self.key_found:
+                        raise JSONStreamError(f"{self.key}\n  repeated key")
+                    self.key_found = True
+                    self.state = "array"
+                else:
+                    self.state = "value"
+            elif self.state == "value":
+                # values of other keys aren't items, they aren't limited
+                decoded, _ = self._decode_value(final, max_size=float("inf"))
+                if not decoded:
+                    break
+                self.state = "after_value"
+            elif self.state == "array":
+                if not self._expect("["):
+                    break
+                self.state = "item_or_end"
+            elif self.state in ("item_or_end", "item"):
+                self._skip_whitespace()
+                if self.position == len(self.buffer):
+                    break
+                if self.state == "item_or_end" and self.buffer[self.position] == "]":
+                    self.position += 1
+                    self.state = "after_value"
+                    continue
+                decoded, item = self._decode_value(final)
+                if not decoded:
+                    break
+                items.append(item)
+                self.state = "after_item"
+            elif self.state == "after_item":
+                char = self._expect(",]")
+                if not char:
+                    break
+                self.state = "item" if char == "," else "after_value"
+            elif self.state == "after_value":
+                char = self._expect(",}")
+                if not char:
+                    break
+                self.state = "key" if char == "," else "done"
+            elif self.state == "done":
+                self._skip_whitespace()
+                if self.position < len(self.buffer):
+                    raise JSONStreamError(f"extra data at {self._offset()}")
+                break
+        return items
+
+    def feed(self, chunk: bytes, final: bool = False) -> List:
+        try:
+            text = self.text_decoder.decode(chunk, final)
+        except UnicodeDecodeError:
+            raise JSONStreamError("body is not valid utf-8")
+        self.buffer = self.buffer[self.position :] + text
+        self.consumed += self.position
+        self.position = 0
+        return self._parse(final)
+
+    def close(self) -> List:
+        items = self.feed(b"", final=True)
+        if self.state != "done":
+            raise JSONStreamError("unexpected end of json")
+        if not self.key_found:
+            raise JSONStreamError(f"{self.key}\n  field required")
+        return items
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator:
+    # items of the `key` array of the json object streamed in `chunks`
+    stream = JSONArrayStream(key)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
@@ -0,0 +1,96 @@
+import os
+import time
+from typing import Hashable
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy.pool import QueuePool
+
+from app.core.config import config
+
+# with several workers every process writes its values to files in
+# $prometheus_multiproc_dir and /metrics of any worker sums them up;
+# the directory has to be emptied before the workers start
+MULTIPROCESS_DIR_ENV = "prometheus_multiproc_dir"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(10 ** power for power in range(2, 10))  # 100B to 1GB
+COUNT_BUCKETS = tuple(10 ** power for power in range(0, 7))
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests by route and status", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SIZE = Histogram(
+    "http_request_size_bytes",
+    "Request bodies by Content-Length",
+    ["method", "route"],
+    buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "Response bodies before compression",
+    ["method", "route"],
+    buckets=SIZE_BUCKETS,
+)
+IMPORT_CITIZENS = Histogram(
+    "import_citizens", "Citizens of stored imports", buckets=COUNT_BUCKETS
+)
+IMPORT_EDGES = Histogram(
+    "import_relation_edges",
+    "Relations of stored imports, each pair of relatives once",
+    buckets=COUNT_BUCKETS,
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time to get a connection from the pool, opening one included",
+    buckets=WAIT_BUCKETS,
+)
+# hit ratio: rate(import_cache_lookups_total{result="hit"}) over all lookups
+CACHE_LOOKUPS = Counter(
+    "import_cache_lookups_total", "Import cache lookups", ["kind", "result"]
+)
+
+
+def observe_import(citizens: int, edges: int):
+    if config.metrics:
+        IMPORT_CITIZENS.observe(citizens)
+        IMPORT_EDGES.observe(edges)
+
+
+def observe_cache_lookup(key: Hashable, hit: bool):
+    if config.metrics:
+        # daily keys are (name, date)
+        kind = key[0] if isinstance(key, tuple) else key
+        CACHE_LOOKUPS.labels(str(kind), "hit" if hit else "miss").inc()
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+def render_metrics() -> bytes:
+    # text exposition format
+    if MULTIPROCESS_DIR_ENV in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
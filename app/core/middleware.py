@@ -0,0 +1,171 @@
+import time
+from datetime import date, datetime
+from typing import Callable, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.conditional import (
+    DAILY_RESOURCE,
+    conditional_resource,
+    etag_matches,
+    http_date,
+    is_settled,
+    make_etag,
+    not_modified_since,
+)
+from app.core.instrumentation import SlowRequestProfiler, start_request
+from app.core.metrics import REQUEST_DURATION, REQUEST_SIZE, REQUESTS, RESPONSE_SIZE
+
+# plain ASGI middlewares: starlette's @app.middleware("http") runs the app in
+# a task of its own and queues its messages, so a streamed body is produced
+# as fast as the db gives it, whatever the client reads; these pass every
+# message on at once, and the app waits for the client like it does alone
+
+
+class DBSessionMiddleware:
+    # a session for the request in request.state.db, closed once the
+    # response, a streamed body included, is sent
+    def __init__(
+        self,
+        app: ASGIApp,
+        session_factory: Callable,
+        instrumented: bool = False,
+        profiler: Optional[SlowRequestProfiler] = None,
+    ):
+        self.app = app
+        self.session_factory = session_factory
+        self.instrumented = instrumented or profiler is not None
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = start_request() if self.instrumented else None
+        db = self.session_factory()
+        scope.setdefault("state", {})["db"] = db
+
+        async def send_with_timing(message: Message):
+            if metrics is not None and message["type"] == "http.response.start":
+                if metrics.handler_done is not None:
+                    serialization = time.perf_counter() - metrics.handler_done
+                    metrics.add_phase("serialization", serialization)
+                # covers the handler up to the headers, not a still streamed body
+                headers = MutableHeaders(raw=message["headers"])
+                headers["Server-Timing"] = metrics.server_timing()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            await run_in_threadpool(db.close)
+        if self.profiler is not None:
+            await run_in_threadpool(
+                self.profiler.finish, metrics, scope["method"], scope["path"]
+            )
+
+
+class ConditionalGetMiddleware:
+    # ETag and Last-Modified of an import's GET resources and 304 for
+    # a matching conditional request; runs inside DBSessionMiddleware
+    def __init__(
+        self,
+        app: ASGIApp,
+        get_import_state: Callable[..., Optional[Tuple[int, datetime]]],
+    ):
+        self.app = app
+        self.get_import_state = get_import_state
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        resource = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            resource = conditional_resource(scope["path"])
+        if resource is None:
+            await self.app(scope, receive, send)
+            return
+        import_id, name = resource
+        # only the import row is read, not the citizen tables
+        state = await run_in_threadpool(
+            self.get_import_state, scope["state"]["db"], import_id
+        )
+        if state is None:
+            await self.app(scope, receive, send)
+            return
+        version, updated_at = state
+        headers = {}
+        if name == DAILY_RESOURCE:
+            headers["ETag"] = make_etag(import_id, version, date.today())
+        else:
+            headers["ETag"] = make_etag(import_id, version)
+            if updated_at is not None and is_settled(updated_at, datetime.utcnow()):
+                headers["Last-Modified"] = http_date(updated_at)
+
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, headers["ETag"])
+        elif if_modified_since is not None and "Last-Modified" in headers:
+            not_modified = not_modified_since(if_modified_since, updated_at)
+        else:
+            not_modified = False
+        if not_modified:
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+
+        async def send_with_validators(message: Message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                MutableHeaders(raw=message["headers"]).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
+
+
+class MetricsMiddleware:
+    # request counts, sizes and latencies by route, the latency
+    # and response size of a streamed response cover all of its body
+    def __init__(self, app: ASGIApp, route_of: Callable[[Scope], str]):
+        self.app = app
+        self.route_of = route_of
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status, size, observed = 500, 0, False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            # the router has put the matched route's endpoint into the scope
+            method, route = scope["method"], self.route_of(scope)
+            REQUESTS.labels(method, route, status).inc()
+            content_length = Headers(scope=scope).get("content-length")
+            if content_length is not None:
+                REQUEST_SIZE.labels(method, route).observe(int(content_length))
+            RESPONSE_SIZE.labels(method, route).observe(size)
+            REQUEST_DURATION.labels(method, route).observe(
+                time.perf_counter() - started
+            )
+
+        async def observed_send(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    # before the client has the whole response, so the next
+                    # request it makes sees this one counted
+                    observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, observed_send)
+        finally:
+            if not observed:
+                observe()
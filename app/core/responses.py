@@ -0,0 +1,41 @@
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List
+
+from starlette.responses import UJSONResponse
+
+CITIZEN_FIELDS = (
+    "citizen_id",
+    "town",
+    "street",
+    "building",
+    "apartment",
+    "name",
+    "birth_date",
+    "gender",
+    "relatives",
+)
+
+
+# there are only so many distinct birth dates, so every one is formatted once
+@lru_cache(maxsize=1 << 16)
+def format_date(value: date) -> str:
+    return f"{value.day:02}.{value.month:02}.{value.year}"
+
+
+def encode_citizens(citizens: Iterable[Dict]) -> List[Dict]:
+    # the fields of the Citizen model, ready for json
+    return [
+        {
+            **{field: citizen[field] for field in CITIZEN_FIELDS},
+            "birth_date": format_date(citizen["birth_date"]),
+        }
+        for citizen in citizens
+    ]
+
+
+class TrustedJSONResponse(UJSONResponse):
+    # for data built by crud from the db: FastAPI doesn't validate returned
+    # Responses against the response_model again, and ujson encodes them
+    def __init__(self, data: Any, **kwargs):
+        super().__init__({"data": data}, **kwargs)
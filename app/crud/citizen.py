@@ -1,21 +1,150 @@
+import csv
+import io
 from collections import defaultdict
-from datetime import datetime
-from typing import List, Dict
+from datetime import date, datetime
+from functools import wraps
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import numpy
-from sqlalchemy.orm import Session
+from sqlalchemy import Table, and_, bindparam, select, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, Session
 
-from app.db_models.citizen import Citizen, Import, Relations
-from app.models.citizen import (
-    CitizenIn as CitizenModel,
-    CitizenUpdateIn as CitizenUpdateModel,
+from app.core import config
+from app.core.cache import import_cache
+from app.core.metrics import observe_import
+from app.crud.presents import presents_select
+from app.db.shards import ShardedSession
+from app.db_models.citizen import Citizen, Import, Presents, Relations, ShardVersion
+from app.models.citizen import CitizenBulkUpdateIn as CitizenBulkUpdateModel
+from app.models.citizen import CitizenUpdateError
+from app.models.citizen import CitizenUpdateIn as CitizenUpdateModel
+
+# longest IN (...) list, sqlite limits the number of bound parameters
+IN_CHUNK_SIZE = 500
+CITIZEN_COLUMNS = (
+    Citizen.citizen_id,
+    Citizen.town,
+    Citizen.street,
+    Citizen.building,
+    Citizen.apartment,
+    Citizen.name,
+    Citizen.birth_date,
+    Citizen.gender,
 )
 
 
+# import_cache key of ImportSnapshot (app.crud.snapshot)
+SNAPSHOT_KEY = "snapshot"
+
+
+class CitizenNotFoundError(LookupError):
+    pass
+
+
+def _in_shard(db: Session, import_id: int) -> bool:
+    return isinstance(db, ShardedSession) and not db.shards.in_main_db(import_id)
+
+
+def get_import_version(db: Session, import_id: int) -> Optional[int]:
+    # None for missing and deleted imports
+    state = get_import_state(db, import_id)
+    return None if state is None else state[0]
+
+
+def get_import_state(db: Session, import_id: int) -> Optional[Tuple[int, datetime]]:
+    # version and updated_at
+    state = (
+        db.query(Import.version, Import.updated_at)
+        .filter(Import.import_id == import_id, Import.deleted_at.is_(None))
+        .first()
+    )
+    if state is None or not _in_shard(db, import_id):
+        return state
+    # the import's rows and their version are in its file, committed together
+    versions = ShardVersion.__table__
+    query = select([versions.c.version, versions.c.updated_at]).where(
+        versions.c.import_id == import_id
+    )
+    shard_state = db.execute(query, bind=db.shards.engine(import_id)).first()
+    if shard_state is None:
+        # never changed since the import
+        return 0, state.updated_at
+    return shard_state.version, shard_state.updated_at
+
+
+def cached_by_import(daily: bool = False) -> Callable:
+    # `daily` results depend on today's date as well as on the import data
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(db: Session, import_id: int):
+            if not import_cache.max_size:
+                return func(db, import_id)
+            version = get_import_version(db, import_id)
+            if version is None:
+                return func(db, import_id)
+            key = (func.__name__, date.today()) if daily else func.__name__
+            found, value = import_cache.get(import_id, key, version)
+            if not found:
+                value = func(db, import_id)
+                import_cache.set(import_id, key, version, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
 def get_citizens_by_import_id(db: Session, import_id: int) -> List[Citizen]:
     return db.query(Citizen).filter(Citizen.import_id == import_id).all()
 
 
+@cached_by_import()
+def get_citizens_data(db: Session, import_id: int) -> List[Dict]:
+    relatives = defaultdict(list)
+    relations = db.query(Relations.citizen_id, Relations.relative_citizen_id).filter(
+        Relations.import_id == import_id
+    )
+    for relation in relations:
+        relatives[relation.citizen_id].append(relation.relative_citizen_id)
+
+    citizens = (
+        db.query(*CITIZEN_COLUMNS)
+        .filter(Citizen.import_id == import_id)
+        .order_by(Citizen.citizen_id)
+    )
+    return [
+        {**citizen._asdict(), "relatives": relatives[citizen.citizen_id]}
+        for citizen in citizens
+    ]
+
+
+def iter_citizens_data(db: Session, import_id: int) -> Iterator[Dict]:
+    # same as get_citizens_data, but merged on the fly
+    # from two cursors instead of being built in memory
+    citizens = (
+        db.query(*CITIZEN_COLUMNS)
+        .filter(Citizen.import_id == import_id)
+        .order_by(Citizen.citizen_id)
+        .yield_per(config.stream_batch_size)
+    )
+    relations = iter(
+        db.query(Relations.citizen_id, Relations.relative_citizen_id)
+        .filter(Relations.import_id == import_id)
+        .order_by(Relations.citizen_id, Relations.relative_citizen_id)
+        .yield_per(config.stream_batch_size)
+    )
+
+    relation = next(relations, None)
+    for citizen in citizens:
+        relatives = []
+        while relation is not None and relation.citizen_id <= citizen.citizen_id:
+            if relation.citizen_id == citizen.citizen_id:
+                relatives.append(relation.relative_citizen_id)
+            relation = next(relations, None)
+        yield {**citizen._asdict(), "relatives": relatives}
+
+
 def get_citizen(db: Session, import_id: int, citizen_id: int) -> Citizen:
     return (
         db.query(Citizen)
@@ -35,132 +164,478 @@ def add_relation(db: Session, import_id: int, id_from: int, id_to: int):
     db.add(citizen_relation_to)
 
 
-def remove_relation(db: Session, import_id: int, id_from: int, id_to: int):
-    relation_from = (
-        db.query(Relations)
-        .filter(
-            Relations.import_id == import_id,
-            Relations.citizen_id == id_from,
-            Relations.relative_citizen_id == id_to,
-        )
-        .first()
+def _chunked(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _citizen_rows(import_id: int, citizens: List[Dict]) -> Iterator[Dict]:
+    for citizen in citizens:
+        yield {
+            "import_id": import_id,
+            "citizen_id": citizen["citizen_id"],
+            "town": citizen["town"],
+            "street": citizen["street"],
+            "building": citizen["building"],
+            "apartment": citizen["apartment"],
+            "name": citizen["name"],
+            "birth_date": citizen["birth_date"],
+            "gender": citizen["gender"],
+        }
+
+
+def _relation_rows(import_id: int, citizens: List[Dict]) -> Iterator[Dict]:
+    # relatives are validated to be symmetric, so every direction
+    # of a relation is listed by one of the citizens
+    for citizen in citizens:
+        for relative_citizen_id in citizen["relatives"]:
+            yield {
+                "import_id": import_id,
+                "citizen_id": citizen["citizen_id"],
+                "relative_citizen_id": relative_citizen_id,
+            }
+
+
+def _copy_rows(connection: Connection, table: Table, rows: Iterator[Dict]):
+    columns = [column.name for column in table.columns if column.name != "id"]
+    copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        connection.dialect.identifier_preparer.format_table(table),
+        ", ".join(columns),
     )
-    relation_to = (
-        db.query(Relations)
-        .filter(
-            Relations.import_id == import_id,
-            Relations.citizen_id == id_to,
-            Relations.relative_citizen_id == id_from,
+    cursor = connection.connection.cursor()
+    for chunk in _chunked(rows, config.import_chunk_size):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([row[c] for c in columns] for row in chunk)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+
+def _insert_rows(db: Session, model: type, rows: Iterator[Dict]):
+    connection = db.connection(mapper=model)
+    if connection.dialect.name == "postgresql":
+        _copy_rows(connection, model.__table__, rows)
+        return
+    for chunk in _chunked(rows, config.import_chunk_size):
+        connection.execute(model.__table__.insert(), chunk)
+
+
+def _create_import(db: Session) -> int:
+    result = db.execute(Import.__table__.insert())
+    return result.inserted_primary_key[0]
+
+
+def _finish_import(db: Session, import_id: int) -> Import:
+    db.execute(
+        Presents.__table__.insert().from_select(
+            ["import_id", "citizen_id", "month", "count"],
+            presents_select(import_id),
         )
-        .first()
     )
-    db.delete(relation_from)
-    db.delete(relation_to)
+    db.commit()
+    return Import(import_id=import_id)
 
 
-def import_users(db: Session, citizens: List[CitizenModel]) -> Import:
-    inverted_inserted_relations = defaultdict(list)
+def import_users(db: Session, citizens: List[Dict]) -> Import:
+    # citizens are validated by validate_citizens_import
+    # plain executemany in chunks (COPY on postgresql), all in one transaction:
+    # the unit-of-work is too slow and memory-hungry for imports of 10k+ citizens
+    import_id = _create_import(db)
+    _insert_rows(db, Citizen, _citizen_rows(import_id, citizens))
+    _insert_rows(db, Relations, _relation_rows(import_id, citizens))
+    db_import = _finish_import(db, import_id)
+    relations = sum(len(citizen["relatives"]) for citizen in citizens)
+    observe_import(len(citizens), relations // 2)
+    return db_import
 
-    db_users_import = Import()
-    db.add(db_users_import)
-    db.commit()
-    db.refresh(db_users_import)
-    for citizen in citizens:
-        db_citizen = Citizen(
-            import_id=db_users_import.import_id,
-            citizen_id=citizen.citizen_id,
-            town=citizen.town,
-            street=citizen.street,
-            building=citizen.building,
-            apartment=citizen.apartment,
-            name=citizen.name,
-            birth_date=citizen.birth_date,
-            gender=citizen.gender,
-        )
 
-        for relative_citizen_id in citizen.relatives:
-            if relative_citizen_id in inverted_inserted_relations[citizen.citizen_id]:
-                continue
-            add_relation(
-                db, db_users_import.import_id, citizen.citizen_id, relative_citizen_id
+def import_users_in_batches(
+    db: Session, batches: Iterable[Tuple[List[Dict], List[Tuple[int, int]]]]
+) -> Import:
+    # batches of citizens with relations between already seen citizens,
+    # as yielded by iter_validated_batches; only a batch is held in memory,
+    # everything is rolled back if a later batch turns out to be invalid
+    citizens_count = relations_count = 0
+    try:
+        import_id = _create_import(db)
+        for citizens, relations in batches:
+            citizens_count += len(citizens)
+            relations_count += len(relations)
+            _insert_rows(db, Citizen, _citizen_rows(import_id, citizens))
+            _insert_rows(
+                db,
+                Relations,
+                (
+                    {
+                        "import_id": import_id,
+                        "citizen_id": citizen_id,
+                        "relative_citizen_id": relative_citizen_id,
+                    }
+                    for citizen_id, relative_citizen_id in relations
+                ),
             )
-            inverted_inserted_relations[relative_citizen_id].append(citizen.citizen_id)
-        db.add(db_citizen)
-    db.commit()
+        db_import = _finish_import(db, import_id)
+    except Exception:
+        db.rollback()
+        raise
+    # relations of a batch hold both directions of every pair
+    observe_import(citizens_count, relations_count // 2)
+    return db_import
 
-    return db_users_import
+
+def _query_in(query: Query, column, values: Iterable[int]) -> Iterator:
+    # rows of an import-filtered query with column in values, one statement
+    # per IN_CHUNK_SIZE values: only the rows asked for are read, whatever
+    # the size of the import
+    for chunk in _chunked(sorted(set(values)), IN_CHUNK_SIZE):
+        yield from query.filter(column.in_(chunk))
+
+
+def _relatives_birth_months(
+    db: Session, import_id: int, citizen_ids: Set[int]
+) -> Dict[int, int]:
+    relatives = db.query(Citizen.citizen_id, Citizen.birth_date).filter(
+        Citizen.import_id == import_id
+    )
+    relatives = _query_in(relatives, Citizen.citizen_id, citizen_ids)
+    return {r.citizen_id: r.birth_date.month for r in relatives}
+
+
+def _apply_presents_delta(
+    db: Session, import_id: int, delta: Dict[Tuple[int, int], int]
+):
+    # delta is {(citizen_id, month): presents count change}
+    delta = {key: change for key, change in delta.items() if change}
+    if not delta:
+        return
+    citizen_ids = {citizen_id for citizen_id, _ in delta}
+    current = db.query(Presents.citizen_id, Presents.month, Presents.count).filter(
+        Presents.import_id == import_id
+    )
+    current = _query_in(current, Presents.citizen_id, citizen_ids)
+    current = {(p.citizen_id, p.month): p.count for p in current}
+
+    to_insert, to_update, to_delete = [], [], []
+    for (citizen_id, month), change in delta.items():
+        count = current.get((citizen_id, month), 0) + change
+        row = {"b_citizen_id": citizen_id, "b_month": month, "b_count": count}
+        if count <= 0:
+            to_delete.append(row)
+        elif (citizen_id, month) in current:
+            to_update.append(row)
+        else:
+            to_insert.append(
+                {
+                    "import_id": import_id,
+                    "citizen_id": citizen_id,
+                    "month": month,
+                    "count": count,
+                }
+            )
+
+    table = Presents.__table__
+    row_filter = and_(
+        table.c.import_id == import_id,
+        table.c.citizen_id == bindparam("b_citizen_id"),
+        table.c.month == bindparam("b_month"),
+    )
+    if to_insert:
+        db.execute(table.insert(), to_insert)
+    if to_update:
+        db.execute(
+            table.update().where(row_filter).values(count=bindparam("b_count")),
+            to_update,
+        )
+    if to_delete:
+        db.execute(table.delete().where(row_filter), to_delete)
 
 
 def update_citizen(
     db: Session, db_citizen: Citizen, update_model: CitizenUpdateModel
 ) -> Citizen:
-    update_data = update_model.dict(skip_defaults=True)
+    # a bulk update of one: the number of queries doesn't depend
+    # on how many relatives are added or removed
+    update = update_model.dict(skip_defaults=True)
+    update["citizen_id"] = db_citizen.citizen_id
+    _apply_updates(db, db_citizen.import_id, [update])
+    db.refresh(db_citizen)
+    return db_citizen
+
+
+def _update_citizens_rows(db: Session, import_id: int, changes: Dict[int, Dict]):
+    # one executemany per set of changed columns
+    by_columns = defaultdict(list)
+    for citizen_id, fields in changes.items():
+        if fields:
+            by_columns[tuple(sorted(fields))].append(
+                {"b_citizen_id": citizen_id, **fields}
+            )
+    table = Citizen.__table__
+    statement = table.update().where(
+        and_(
+            table.c.import_id == import_id,
+            table.c.citizen_id == bindparam("b_citizen_id"),
+        )
+    )
+    for rows in by_columns.values():
+        db.execute(statement, rows)
+
+
+def _apply_relations_diff(
+    db: Session,
+    import_id: int,
+    to_create: Set[Tuple[int, int]],
+    to_remove: Set[Tuple[int, int]],
+):
+    # pairs of relatives, both directions of each are written; removed ones
+    # go with one DELETE ... WHERE (citizen_id, relative_citizen_id) IN (...)
+    # per direction, and per IN_CHUNK_SIZE bound parameters
+    table = Relations.__table__
+    directions = [
+        tuple_(table.c.citizen_id, table.c.relative_citizen_id),
+        tuple_(table.c.relative_citizen_id, table.c.citizen_id),
+    ]
+    for chunk in _chunked(sorted(to_remove), IN_CHUNK_SIZE // 2):
+        for direction in directions:
+            db.execute(
+                table.delete().where(
+                    and_(table.c.import_id == import_id, direction.in_(chunk))
+                )
+            )
+    if to_create:
+        db.execute(
+            table.insert(),
+            [
+                {
+                    "import_id": import_id,
+                    "citizen_id": id_from,
+                    "relative_citizen_id": id_to,
+                }
+                for pair in to_create
+                for id_from, id_to in (pair, pair[::-1])
+            ],
+        )
+
+
+def update_citizens(
+    db: Session, import_id: int, update_models: List[CitizenBulkUpdateModel]
+) -> List[Dict]:
+    # same result as update_citizen for every model in order
+    updates = [model.dict(skip_defaults=True) for model in update_models]
+    return _apply_updates(db, import_id, updates)
+
+
+def _apply_updates(db: Session, import_id: int, updates: List[Dict]) -> List[Dict]:
+    # the affected citizens and relations are read once, the updates are
+    # played in memory and only the net diff is written in one transaction
+    if not updates:
+        return []
+    updated_ids = list(dict.fromkeys(update["citizen_id"] for update in updates))
+
+    citizens = db.query(*CITIZEN_COLUMNS).filter(Citizen.import_id == import_id)
+    citizens = {
+        c.citizen_id: c._asdict()
+        for c in _query_in(citizens, Citizen.citizen_id, updated_ids)
+    }
+    for citizen_id in updated_ids:
+        if citizen_id not in citizens:
+            raise CitizenNotFoundError(f"Citizen {citizen_id} not found")
+
+    relatives = {citizen_id: set() for citizen_id in citizens}
+    relations = db.query(Relations.citizen_id, Relations.relative_citizen_id).filter(
+        Relations.import_id == import_id
+    )
+    for relation in _query_in(relations, Relations.citizen_id, updated_ids):
+        relatives[relation.citizen_id].add(relation.relative_citizen_id)
+
+    months = {citizen_id: c["birth_date"].month for citizen_id, c in citizens.items()}
+    mentioned = {r for update in updates for r in update.get("relatives", ())}
+    months.update(
+        _relatives_birth_months(
+            db, import_id, mentioned.union(*relatives.values()) - months.keys()
+        )
+    )
 
-    to_update = {k: v for k, v in update_data.items() if k != "relatives"}
-    db.query(Citizen).filter_by(id=db_citizen.id).update(to_update)
+    # relation pair (smaller id first) -> whether it exists now / did before
+    pairs, pairs_before = {}, {}
+    presents_delta = defaultdict(int)
+    changes = defaultdict(dict)
+    for update in updates:
+        citizen_id = update.pop("citizen_id")
+        old_month = months[citizen_id]
+        new_month = update["birth_date"].month if "birth_date" in update else old_month
+        current_relatives = relatives[citizen_id]
+        new_relatives = set(update.pop("relatives", current_relatives))
+        for rel_id in new_relatives:
+            if rel_id == citizen_id or rel_id not in months:
+                raise CitizenUpdateError(
+                    f"citizen {citizen_id}: unknown relative {rel_id}"
+                )
+        relatives_to_remove = current_relatives - new_relatives
+        relatives_to_create = new_relatives - current_relatives
 
-    if "relatives" in update_data:
-        current_relatives = {rel.relative_citizen_id for rel in db_citizen.relatives}
-        relatives_to_remove = current_relatives - set(update_model.relatives)
-        relatives_to_create = set(update_model.relatives) - current_relatives
         for rel_id in relatives_to_remove:
-            remove_relation(db, db_citizen.import_id, db_citizen.citizen_id, rel_id)
+            presents_delta[(citizen_id, months[rel_id])] -= 1
+            presents_delta[(rel_id, old_month)] -= 1
         for rel_id in relatives_to_create:
-            add_relation(db, db_citizen.import_id, db_citizen.citizen_id, rel_id)
+            presents_delta[(citizen_id, months[rel_id])] += 1
+            presents_delta[(rel_id, new_month)] += 1
+        if new_month != old_month:
+            for rel_id in current_relatives & new_relatives:
+                presents_delta[(rel_id, old_month)] -= 1
+                presents_delta[(rel_id, new_month)] += 1
 
-    db.add(db_citizen)
+        for rel_id in relatives_to_remove | relatives_to_create:
+            exists = rel_id in relatives_to_create
+            pair = (min(citizen_id, rel_id), max(citizen_id, rel_id))
+            pairs_before.setdefault(pair, not exists)
+            pairs[pair] = exists
+            if rel_id in relatives and exists:
+                relatives[rel_id].add(citizen_id)
+            elif rel_id in relatives:
+                relatives[rel_id].discard(citizen_id)
+        relatives[citizen_id] = new_relatives
+        months[citizen_id] = new_month
+        citizens[citizen_id].update(update)
+        changes[citizen_id].update(update)
+
+    to_create = {p for p, exists in pairs.items() if exists and not pairs_before[p]}
+    to_remove = {p for p, exists in pairs.items() if not exists and pairs_before[p]}
+    _update_citizens_rows(db, import_id, changes)
+    _apply_relations_diff(db, import_id, to_create, to_remove)
+    _apply_presents_delta(db, import_id, presents_delta)
+    sharded = isinstance(db, ShardedSession)
+    now = datetime.utcnow()
+    bump_import = (
+        Import.__table__.update()
+        .where(Import.import_id == import_id)
+        .values(version=Import.version + 1, updated_at=now)
+    )
+    if _in_shard(db, import_id):
+        # the import row is in the main db, whose statements commit at once:
+        # it's bumped first, so content digests stop matching before the
+        # rows change, and ETags and cached results go by the version in
+        # the import's file, committed with the rows
+        db.execute(bump_import)
+        _bump_shard_version(db, import_id, now)
+    else:
+        # in the rows' transaction, in the main db with shards as well
+        db.execute(bump_import, bind=db.get_bind(mapper=Citizen))
+    version = get_import_version(db, import_id) if config.snapshot_reads else None
     db.commit()
-    db.refresh(db_citizen)
-    return db_citizen
 
+    found, snapshot = False, None
+    # with shards a snapshot cached under the previous version may have been
+    # loaded from the new rows already, it's loaded again instead
+    if version is not None and not sharded:
+        found, snapshot = import_cache.get(import_id, SNAPSHOT_KEY, version - 1)
+    import_cache.invalidate(import_id)
+    if found:
+        # patched instead of being loaded again from the db
+        snapshot = snapshot.updated(changes, to_create, to_remove)
+        import_cache.set(import_id, SNAPSHOT_KEY, version, snapshot)
 
-def get_citizens_presents(db: Session, import_id: int) -> Dict[str, List[Dict]]:
-    birthdays_presents = {}
-    for month_number in range(1, 13):
-        birthdays_presents[str(month_number)] = []
-        for citizen in get_citizens_by_import_id(db, import_id):
-            presents_counter = 0
-            for rel in citizen.relatives:
-                relative = get_citizen(db, import_id, rel.relative_citizen_id)
-                if relative.birth_date.month != month_number:
-                    continue
-                presents_counter += 1
-            if presents_counter == 0:
-                continue
-            birthdays_presents[str(month_number)].append(
-                {"citizen_id": citizen.citizen_id, "presents": presents_counter}
+    return [
+        {**citizens[citizen_id], "relatives": sorted(relatives[citizen_id])}
+        for citizen_id in updated_ids
+    ]
+
+
+def _bump_shard_version(db: Session, import_id: int, updated_at: datetime):
+    versions = ShardVersion.__table__
+    bumped = db.execute(
+        versions.update()
+        .where(versions.c.import_id == import_id)
+        .values(version=versions.c.version + 1, updated_at=updated_at)
+    )
+    if not bumped.rowcount:
+        db.execute(
+            versions.insert().values(
+                import_id=import_id, version=1, updated_at=updated_at
             )
+        )
+
+
+@cached_by_import()
+def get_citizens_presents(db: Session, import_id: int) -> Dict[str, List[Dict]]:
+    presents = (
+        db.query(Presents.month, Presents.citizen_id, Presents.count)
+        .filter(Presents.import_id == import_id)
+        .order_by(Presents.month, Presents.citizen_id)
+    )
+
+    birthdays_presents = {str(month_number): [] for month_number in range(1, 13)}
+    for row in presents:
+        birthdays_presents[str(row.month)].append(
+            {"citizen_id": row.citizen_id, "presents": row.count}
+        )
     return birthdays_presents
 
 
-def calculate_age(born: datetime):
+def calculate_ages(birth_dates: numpy.ndarray) -> numpy.ndarray:
     today = datetime.today()
-    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+    years = birth_dates.astype("datetime64[Y]").astype(int) + 1970
+    months = birth_dates.astype("datetime64[M]")
+    days = (birth_dates - months).astype(int) + 1
+    months = months.astype(int) % 12 + 1
+    not_yet = today.month * 100 + today.day < months * 100 + days
+    return today.year - years - not_yet
+
 
+def grouped_percentiles(
+    values: numpy.ndarray, starts: numpy.ndarray, sizes: numpy.ndarray, q: float
+) -> numpy.ndarray:
+    # same as numpy.percentile(interpolation="linear") for every group
+    # of already sorted `values` at once
+    positions = (sizes - 1) * (q / 100)
+    lower = numpy.floor(positions).astype(int)
+    upper = numpy.ceil(positions).astype(int)
+    below = values[starts + lower]
+    above = values[starts + upper]
+    return below + (above - below) * (positions - lower)
 
+
+@cached_by_import(daily=True)
 def get_age_stats_by_town(db: Session, import_id: int) -> List[Dict]:
-    stats_by_town = []
-    towns = (
-        db.query(Citizen.town)
+    citizens = (
+        db.query(Citizen.town, Citizen.birth_date)
         .filter(Citizen.import_id == import_id)
-        .group_by(Citizen.town)
+        .order_by(Citizen.town)
         .all()
     )
-    towns = [t.town for t in towns]
-    for town in towns:
-        citizens = (
-            db.query(Citizen.birth_date)
-            .filter(Citizen.import_id == import_id, Citizen.town == town)
-            .all()
-        )
-        ages = [calculate_age(c.birth_date) for c in citizens]
-        percentiles = numpy.percentile(ages, [50, 75, 99], interpolation="linear")
-        stats_by_town.append(
-            {
-                "town": town,
-                "p50": round(percentiles[0], 2),
-                "p75": round(percentiles[1], 2),
-                "p99": round(percentiles[2], 2),
-            }
-        )
-    return stats_by_town
+    if not citizens:
+        return []
+
+    towns, birth_dates = zip(*citizens)
+    ages = calculate_ages(numpy.array(birth_dates, dtype="datetime64[D]"))
+
+    # rows come ordered by town, so every town is a contiguous group
+    town_changes = [0] + [
+        i for i in range(1, len(towns)) if towns[i] != towns[i - 1]
+    ]
+    starts = numpy.array(town_changes)
+    sizes = numpy.diff(numpy.append(starts, len(towns)))
+    groups = numpy.repeat(numpy.arange(len(starts)), sizes)
+    ages = ages[numpy.lexsort((ages, groups))].astype(float)
+
+    return percentiles_by_town([towns[start] for start in town_changes], ages, starts)
+
+
+def percentiles_by_town(
+    towns: List[str], ages: numpy.ndarray, starts: numpy.ndarray
+) -> List[Dict]:
+    # ages of every town are sorted and begin at its start
+    sizes = numpy.diff(numpy.append(starts, len(ages)))
+    p50, p75, p99 = (
+        numpy.round(grouped_percentiles(ages, starts, sizes, q), 2)
+        for q in (50, 75, 99)
+    )
+    return [
+        {"town": town, "p50": float(p50[i]), "p75": float(p75[i]), "p99": float(p99[i])}
+        for i, town in enumerate(towns)
+    ]
@@ -0,0 +1,147 @@
+import hashlib
+import json
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.db_models.citizen import Import
+from app.db_models.import_digest import ImportDigest
+
+# (digest, whether it's a content digest)
+Digest = Tuple[str, bool]
+
+
+class IdempotencyKeyReusedError(ValueError):
+    pass
+
+
+def _citizen_line(citizen: Dict) -> bytes:
+    fields = [
+        citizen["citizen_id"],
+        citizen["town"],
+        citizen["street"],
+        citizen["building"],
+        citizen["apartment"],
+        citizen["name"],
+        citizen["birth_date"].isoformat(),
+        citizen["gender"],
+        sorted(citizen["relatives"]),
+    ]
+    return json.dumps(fields, ensure_ascii=False).encode() + b"\n"
+
+
+def content_digest(citizens: List[Dict]) -> Digest:
+    # the same for payloads differing only in the order of citizens,
+    # relatives or fields, as validate_citizens_import accepts them
+    digest = hashlib.sha256()
+    for citizen in sorted(citizens, key=itemgetter("citizen_id")):
+        digest.update(_citizen_line(citizen))
+    return f"sha256:{digest.hexdigest()}", True
+
+
+class KeyContent:
+    # digest of the citizens posted with an Idempotency-Key, like
+    # content_digest whatever their order, but summed up citizen by citizen
+    # so a streamed import gets it without keeping them
+    def __init__(self, citizens: Iterable[Dict] = ()):
+        self._sum = 0
+        self.add(citizens)
+
+    def add(self, citizens: Iterable[Dict]):
+        for citizen in citizens:
+            line = hashlib.sha256(_citizen_line(citizen)).digest()
+            self._sum = (self._sum + int.from_bytes(line, "big")) % 2 ** 256
+
+    def tracked(self, batches: Iterator[Tuple]) -> Iterator[Tuple]:
+        # (citizens, relations) batches of import_users_in_batches
+        for citizens, relations in batches:
+            self.add(citizens)
+            yield citizens, relations
+
+    def hexdigest(self) -> str:
+        return f"sum256:{self._sum:064x}"
+
+
+def key_digest(idempotency_key: str) -> Digest:
+    return f"key:{hashlib.sha256(idempotency_key.encode()).hexdigest()}", False
+
+
+def request_digests(
+    citizens: Optional[List[Dict]], idempotency_key: Optional[str]
+) -> List[Digest]:
+    digests = [key_digest(idempotency_key)] if idempotency_key else []
+    if citizens is not None:
+        digests.append(content_digest(citizens))
+    return digests
+
+
+def find_import(
+    db: Session, digests: List[Digest], content: Callable[[], Optional[str]]
+) -> Optional[int]:
+    # `content` gives the request's KeyContent, called once a key is found
+    if not digests:
+        return None
+    rows = (
+        db.query(ImportDigest.import_id, ImportDigest.content)
+        .join(Import, Import.import_id == ImportDigest.import_id)
+        .filter(
+            ImportDigest.digest.in_([digest for digest, _ in digests]),
+            Import.deleted_at.is_(None),
+            or_(
+                ImportDigest.version.is_(None),
+                ImportDigest.version == Import.version,
+            ),
+        )
+        .all()
+    )
+    # keys saved before their content was checked match any citizens
+    key_contents = {row.content for row in rows if row.content is not None}
+    if key_contents and key_contents != {content()}:
+        raise IdempotencyKeyReusedError(
+            "Idempotency-Key was already used with other citizens"
+        )
+    return rows[0].import_id if rows else None
+
+
+def save_import_digests(
+    db: Session, digests: List[Digest], import_id: int, content: Optional[str]
+):
+    if not digests:
+        return
+    # a content digest of a since PATCHed import is taken over by this one
+    for digest, is_content in digests:
+        db.merge(
+            ImportDigest(
+                digest=digest,
+                import_id=import_id,
+                version=0 if is_content else None,
+                content=None if is_content else content,
+            )
+        )
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent duplicate has just saved it, keep theirs
+        db.rollback()
+
+
+def import_once(
+    db: Session,
+    digests: List[Digest],
+    write: Callable[[], Import],
+    content: Callable[[], Optional[str]] = lambda: None,
+) -> Import:
+    # the import already stored for any of `digests`, or the one `write` stores;
+    # `content` gives the request's KeyContent once `write` is done
+    import_id = find_import(db, digests, content)
+    if import_id is not None:
+        return Import(import_id=import_id)
+    db_import = write()
+    has_key = any(not is_content for _, is_content in digests)
+    save_import_digests(
+        db, digests, db_import.import_id, content() if has_key else None
+    )
+    return db_import
@@ -0,0 +1,52 @@
+from typing import Callable, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.db_models.import_job import ImportJob
+
+
+# statuses of jobs not finished yet
+RUNNING_STATUSES = ("validating", "importing")
+
+
+def create_import_job(db: Session, worker: str) -> ImportJob:
+    job = ImportJob(status="validating", worker=worker)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_import_job(db: Session, job_id: int) -> Optional[ImportJob]:
+    return db.query(ImportJob).filter(ImportJob.job_id == job_id).first()
+
+
+def update_import_job(db: Session, job_id: int, **fields):
+    db.query(ImportJob).filter(ImportJob.job_id == job_id).update(fields)
+    db.commit()
+
+
+def set_import_job_progress(bind: Engine, job_id: int, citizens_done: int):
+    # a statement of its own, committed at once
+    jobs = ImportJob.__table__
+    bind.execute(
+        jobs.update()
+        .where(jobs.c.job_id == job_id)
+        .values(citizens_done=citizens_done)
+    )
+
+
+def fail_abandoned_import_jobs(db: Session, is_running: Callable[[str], bool]) -> int:
+    # jobs whose worker isn't running them anymore, e.g. left by a restart
+    jobs = db.query(ImportJob.job_id, ImportJob.worker).filter(
+        ImportJob.status.in_(RUNNING_STATUSES)
+    )
+    abandoned = [job.job_id for job in jobs if not is_running(job.worker)]
+    if abandoned:
+        db.query(ImportJob).filter(ImportJob.job_id.in_(abandoned)).update(
+            {ImportJob.status: "failed", ImportJob.error: "server restarted"},
+            synchronize_session=False,
+        )
+    db.commit()
+    return len(abandoned)
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import import_cache
+from app.db_models.citizen import Citizen, Import, Presents, Relations
+from app.db.shards import ShardedSession, route_to_import
+from app.db_models.import_digest import ImportDigest
+
+# relations reference citizens, so they go first; every table is deleted in
+# the order of an index starting with import_id, so a batch is a range scan
+PURGE_ORDER = [
+    (Relations.__table__, ["citizen_id", "relative_citizen_id"]),
+    (Presents.__table__, ["month", "citizen_id"]),
+    (Citizen.__table__, ["citizen_id"]),
+]
+
+
+def is_deleted_import(db: Session, import_id: int) -> bool:
+    deleted_at = (
+        db.query(Import.deleted_at).filter(Import.import_id == import_id).scalar()
+    )
+    return deleted_at is not None
+
+
+def delete_import(db: Session, import_id: int) -> bool:
+    # marks the import deleted, its rows are removed later by purge_import_batch
+    deleted = (
+        db.query(Import)
+        .filter(Import.import_id == import_id, Import.deleted_at.is_(None))
+        .update({Import.deleted_at: datetime.utcnow()}, synchronize_session=False)
+    )
+    db.commit()
+    import_cache.invalidate(import_id)
+    return bool(deleted)
+
+
+def expire_imports(db: Session, retention: timedelta) -> int:
+    expired = (
+        db.query(Import)
+        .filter(
+            Import.deleted_at.is_(None),
+            Import.created_at < datetime.utcnow() - retention,
+        )
+        .update({Import.deleted_at: datetime.utcnow()}, synchronize_session=False)
+    )
+    db.commit()
+    return expired
+
+
+def _up_to(columns: List, values: List):
+    # (columns) <= (values) in lexicographic order
+    if len(columns) == 1:
+        return columns[0] <= values[0]
+    return or_(
+        columns[0] < values[0],
+        and_(columns[0] == values[0], _up_to(columns[1:], values[1:])),
+    )
+
+
+def _delete_rows_batch(db: Session, table, keys: List[str], import_id: int, size: int):
+    columns = [table.c[key] for key in keys]
+    last = db.execute(
+        select(columns)
+        .where(table.c.import_id == import_id)
+        .order_by(*columns)
+        .offset(size - 1)
+        .limit(1)
+    ).first()
+    query = table.delete().where(table.c.import_id == import_id)
+    if last is not None:
+        query = query.where(_up_to(columns, list(last)))
+    return db.execute(query).rowcount
+
+
+def purge_import_batch(db: Session, size: int) -> Optional[int]:
+    # deletes at most `size` rows of a deleted import in one short
+    # transaction, and the import itself once it has no rows left;
+    # None when there's nothing to purge
+    import_id = (
+        db.query(Import.import_id)
+        .filter(Import.deleted_at.isnot(None))
+        .order_by(Import.deleted_at)
+        .limit(1)
+        .scalar()
+    )
+    if import_id is None:
+        return None
+    sharded = isinstance(db, ShardedSession)
+    if sharded and not db.shards.in_main_db(import_id):
+        # the import's rows go with its file
+        db.shards.drop(import_id)
+    else:
+        route_to_import(db, import_id)
+        for table, keys in PURGE_ORDER:
+            deleted = _delete_rows_batch(db, table, keys, import_id, size)
+            if deleted:
+                db.commit()
+                return deleted
+        # with shards the import row is written by another connection
+        db.commit()
+        if sharded:
+            db.shards.main_db_imports.discard(import_id)
+    db.query(ImportDigest).filter(ImportDigest.import_id == import_id).delete()
+    db.query(Import).filter(Import.import_id == import_id).delete()
+    db.commit()
+    return 1
+
+
+def reclaim_space(db: Session, pages: int) -> int:
+    # returns free pages of an sqlite db with auto_vacuum=INCREMENTAL to the
+    # file system, at most `pages` of them; postgresql's autovacuum makes
+    # deleted rows' space reusable on its own
+    engine = db.get_bind()
+    if engine.dialect.name != "sqlite":
+        return 0
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        cursor.close()
+        # the pragma frees a page per step of its statement, and the sqlite3
+        # module steps statements without result columns only once,
+        # executescript runs it to the end
+        connection.connection.executescript(f"PRAGMA incremental_vacuum({pages:d})")
+    finally:
+        connection.close()
+    return min(free_pages, pages)
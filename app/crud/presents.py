@@ -0,0 +1,37 @@
+from typing import Optional
+
+from sqlalchemy import and_, extract, func, select
+from sqlalchemy.sql import Select
+
+from app.db_models.citizen import Citizen, Relations
+
+
+def presents_select(import_id: Optional[int] = None) -> Select:
+    # (import_id, citizen_id, month, count) rows of the birthdays calendar
+    # of `import_id`, or of every import for the migration filling it
+    relations = Relations.__table__
+    relative = Citizen.__table__.alias("relative")
+    relative_birth_month = extract("month", relative.c.birth_date)
+    presents = (
+        select(
+            [
+                relations.c.import_id,
+                relations.c.citizen_id,
+                relative_birth_month.label("month"),
+                func.count().label("count"),
+            ]
+        )
+        .select_from(
+            relations.join(
+                relative,
+                and_(
+                    relative.c.import_id == relations.c.import_id,
+                    relative.c.citizen_id == relations.c.relative_citizen_id,
+                ),
+            )
+        )
+        .group_by(relations.c.import_id, relations.c.citizen_id, relative_birth_month)
+    )
+    if import_id is not None:
+        presents = presents.where(relations.c.import_id == import_id)
+    return presents
@@ -0,0 +1,278 @@
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy
+from sqlalchemy.orm import Session
+
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    CITIZEN_COLUMNS,
+    SNAPSHOT_KEY,
+    calculate_ages,
+    get_import_version,
+    percentiles_by_town,
+)
+from app.db_models.citizen import Citizen, Relations
+
+GENDERS = ["female", "male"]
+
+
+def _encode(values: List[str]) -> Tuple[List[str], numpy.ndarray]:
+    # sorted distinct values and the index of every value in them
+    values = numpy.array(values, dtype=object)
+    distinct, codes = numpy.unique(values, return_inverse=True)
+    return list(distinct), codes.astype(numpy.int32)
+
+
+class ImportSnapshot:
+    # citizens of an import as columns ordered by citizen_id: strings
+    # repeated across citizens are stored once and referenced by code,
+    # relatives are a CSR adjacency: indices[indptr[i]:indptr[i + 1]]
+    # are positions of the relatives of citizen i.
+    # Never changed after creation, updates make a new snapshot sharing
+    # the untouched columns, so readers need no locks
+    def __init__(self, columns: Dict, indptr: numpy.ndarray, indices: numpy.ndarray):
+        self.citizen_ids = columns["citizen_id"]
+        self.towns, self.town_codes = columns["town"]
+        self.streets, self.street_codes = columns["street"]
+        self.buildings, self.building_codes = columns["building"]
+        self.apartments = columns["apartment"]
+        self.names = columns["name"]
+        self.birth_dates = columns["birth_date"]
+        self.genders = columns["gender"]
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def load(cls, db: Session, import_id: int) -> "ImportSnapshot":
+        citizens = (
+            db.query(*CITIZEN_COLUMNS)
+            .filter(Citizen.import_id == import_id)
+            .order_by(Citizen.citizen_id)
+            .all()
+        )
+        relations = (
+            db.query(Relations.citizen_id, Relations.relative_citizen_id)
+            .filter(Relations.import_id == import_id)
+            .all()
+        )
+        (
+            citizen_ids,
+            towns,
+            streets,
+            buildings,
+            apartments,
+            names,
+            birth_dates,
+            genders,
+        ) = zip(*citizens) if citizens else [()] * len(CITIZEN_COLUMNS)
+        citizen_ids = numpy.array(citizen_ids, dtype=numpy.int64)
+        columns = {
+            "citizen_id": citizen_ids,
+            "town": _encode(towns),
+            "street": _encode(streets),
+            "building": _encode(buildings),
+            "apartment": numpy.array(apartments, dtype=numpy.int64),
+            "name": list(names),
+            "birth_date": numpy.array(birth_dates, dtype="datetime64[D]"),
+            "gender": numpy.array([g == "male" for g in genders], dtype=numpy.int8),
+        }
+        relations = numpy.array(relations, dtype=numpy.int64).reshape(-1, 2)
+        edges = numpy.searchsorted(citizen_ids, relations)
+        indptr, indices = cls._csr(len(citizen_ids), edges[:, 0], edges[:, 1])
+        return cls(columns, indptr, indices)
+
+    @staticmethod
+    def _csr(
+        size: int, sources: numpy.ndarray, targets: numpy.ndarray
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        order = numpy.lexsort((targets, sources))
+        counts = numpy.bincount(sources, minlength=size)
+        indptr = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+        return indptr, targets[order].astype(numpy.int32)
+
+    def _edges(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        sources = numpy.repeat(
+            numpy.arange(len(self.citizen_ids)), numpy.diff(self.indptr)
+        )
+        return sources, self.indices.astype(numpy.int64)
+
+    def citizens_json(self) -> bytes:
+        # GET /imports/{import_id}/citizens response body
+        birth_dates = self.birth_dates
+        years = birth_dates.astype("datetime64[Y]").astype(int) + 1970
+        months = birth_dates.astype("datetime64[M]")
+        days = (birth_dates - months).astype(int) + 1
+        months = months.astype(int) % 12 + 1
+        citizen_ids = self.citizen_ids.tolist()
+        indptr, indices = self.indptr.tolist(), self.indices
+        citizens = [
+            {
+                "citizen_id": citizen_ids[i],
+                "town": self.towns[town],
+                "street": self.streets[street],
+                "building": self.buildings[building],
+                "apartment": apartment,
+                "name": name,
+                "birth_date": f"{day:02}.{month:02}.{year}",
+                "gender": GENDERS[gender],
+                "relatives": [
+                    citizen_ids[r] for r in indices[indptr[i] : indptr[i + 1]]
+                ],
+            }
+            for i, (town, street, building, apartment, name, day, month, year, gender)
+            in enumerate(
+                zip(
+                    self.town_codes.tolist(),
+                    self.street_codes.tolist(),
+                    self.building_codes.tolist(),
+                    self.apartments.tolist(),
+                    self.names,
+                    days.tolist(),
+                    months.tolist(),
+                    years.tolist(),
+                    self.genders.tolist(),
+                )
+            )
+        ]
+        return json.dumps(
+            {"data": citizens}, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+
+    def presents(self) -> Dict[str, List[Dict]]:
+        # every citizen buys a present in the birth month of every relative
+        sources, targets = self._edges()
+        months = self.birth_dates.astype("datetime64[M]").astype(int) % 12
+        keys = months[targets] * len(self.citizen_ids) + sources
+        keys, counts = numpy.unique(keys, return_counts=True)
+        months, positions = numpy.divmod(keys, len(self.citizen_ids) or 1)
+        citizen_ids = self.citizen_ids[positions]
+
+        presents = {str(month_number): [] for month_number in range(1, 13)}
+        for month, citizen_id, count in zip(
+            months.tolist(), citizen_ids.tolist(), counts.tolist()
+        ):
+            presents[str(month + 1)].append(
+                {"citizen_id": citizen_id, "presents": count}
+            )
+        return presents
+
+    def age_stats(self) -> List[Dict]:
+        if not len(self.citizen_ids):
+            return []
+        ages = calculate_ages(self.birth_dates)
+        order = numpy.lexsort((ages, self.town_codes))
+        sizes = numpy.bincount(self.town_codes, minlength=len(self.towns))
+        towns = numpy.flatnonzero(sizes)
+        starts = numpy.cumsum(sizes[towns]) - sizes[towns]
+        return percentiles_by_town(
+            [self.towns[town] for town in towns], ages[order].astype(float), starts
+        )
+
+    def updated(
+        self,
+        changes: Dict[int, Dict],
+        to_create: Set[Tuple[int, int]],
+        to_remove: Set[Tuple[int, int]],
+    ) -> "ImportSnapshot":
+        # a snapshot with fields of `changes` citizens replaced and relation
+        # pairs added and removed, untouched columns are shared with this one
+        positions = {
+            citizen_id: int(numpy.searchsorted(self.citizen_ids, citizen_id))
+            for citizen_id in changes
+        }
+        columns = {
+            "citizen_id": self.citizen_ids,
+            "town": (self.towns, self.town_codes),
+            "street": (self.streets, self.street_codes),
+            "building": (self.buildings, self.building_codes),
+            "apartment": self.apartments,
+            "name": self.names,
+            "birth_date": self.birth_dates,
+            "gender": self.genders,
+        }
+        for field in ("town", "street", "building"):
+            values = {positions[c]: f[field] for c, f in changes.items() if field in f}
+            if values:
+                distinct, codes = columns[field]
+                strings = numpy.array(distinct, dtype=object)[codes]
+                strings[list(values)] = list(values.values())
+                columns[field] = _encode(strings.tolist())
+        for field, convert in (
+            ("apartment", int),
+            ("birth_date", numpy.datetime64),
+            ("gender", GENDERS.index),
+        ):
+            values = {positions[c]: f[field] for c, f in changes.items() if field in f}
+            if values:
+                column = columns[field].copy()
+                for position, value in values.items():
+                    column[position] = convert(value)
+                columns[field] = column
+        names = {positions[c]: f["name"] for c, f in changes.items() if "name" in f}
+        if names:
+            columns["name"] = list(self.names)
+            for position, name in names.items():
+                columns["name"][position] = name
+
+        indptr, indices = self.indptr, self.indices
+        if to_create or to_remove:
+            size = len(self.citizen_ids)
+            sources, targets = self._edges()
+            keys = sources * size + targets
+
+            def pair_keys(pairs: Set[Tuple[int, int]]) -> numpy.ndarray:
+                pairs = numpy.array(sorted(pairs), dtype=numpy.int64).reshape(-1, 2)
+                pairs = numpy.searchsorted(self.citizen_ids, pairs)
+                pairs = numpy.concatenate((pairs, pairs[:, ::-1]))
+                return pairs[:, 0] * size + pairs[:, 1]
+
+            keys = keys[~numpy.isin(keys, pair_keys(to_remove))]
+            keys = numpy.concatenate((keys, pair_keys(to_create)))
+            sources, targets = numpy.divmod(keys, size)
+            indptr, indices = self._csr(size, sources, targets)
+        return ImportSnapshot(columns, indptr, indices)
+
+    def memory_size(self) -> int:
+        # bytes held by the snapshot, strings counted once per distinct value
+        arrays = (
+            self.citizen_ids,
+            self.town_codes,
+            self.street_codes,
+            self.building_codes,
+            self.apartments,
+            self.birth_dates,
+            self.genders,
+            self.indptr,
+            self.indices,
+        )
+        lists = (self.towns, self.streets, self.buildings, self.names)
+        return (
+            sum(array.nbytes for array in arrays)
+            + sum(sys.getsizeof(values) for values in lists)
+            + sum(sys.getsizeof(value) for values in lists for value in values)
+        )
+
+
+def get_import_snapshot(db: Session, import_id: int) -> ImportSnapshot:
+    version = get_import_version(db, import_id)
+    if version is None:
+        return ImportSnapshot.load(db, import_id)
+    found, snapshot = import_cache.get(import_id, SNAPSHOT_KEY, version)
+    if not found:
+        snapshot = ImportSnapshot.load(db, import_id)
+        import_cache.set(import_id, SNAPSHOT_KEY, version, snapshot)
+    return snapshot
+
+
+def snapshots_stats() -> Dict[str, Optional[float]]:
+    snapshots = import_cache.values(SNAPSHOT_KEY)
+    citizens = sum(len(snapshot.citizen_ids) for snapshot in snapshots)
+    size = sum(snapshot.memory_size() for snapshot in snapshots)
+    return {
+        "snapshots": len(snapshots),
+        "citizens": citizens,
+        "bytes": size,
+        "bytes_per_citizen": round(size / citizens, 1) if citizens else None,
+    }
@@ -1,4 +1,12 @@
 # Import all the models, so that Base has them before being
 # imported by Alembic
 from app.db.base_class import Base  # noqa
-from app.db_models.citizen import Citizen, Relations, Import  # noqa
+from app.db_models.citizen import (  # noqa
+    Citizen,
+    Relations,
+    Import,
+    Presents,
+    ShardVersion,
+)
+from app.db_models.import_job import ImportJob  # noqa
+from app.db_models.import_digest import ImportDigest  # noqa
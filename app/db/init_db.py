@@ -0,0 +1,151 @@
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Table,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+
+from app.crud.presents import presents_select
+from app.db.base import Base, Citizen, Import, Presents
+
+migrations_metadata = MetaData()
+schema_version = Table(
+    "schema_version", migrations_metadata, Column("version", Integer, nullable=False)
+)
+
+
+def add_import_version(connection: Connection):
+    connection.execute(
+        text('ALTER TABLE "import" ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    )
+
+
+def fill_presents(connection: Connection):
+    connection.execute(
+        Presents.__table__.insert().from_select(
+            ["import_id", "citizen_id", "month", "count"], presents_select()
+        )
+    )
+
+
+def create_indexes(connection: Connection, table: Table, names: Iterable[str] = None):
+    # indexes of the model missing in the db, all of them or `names`
+    existing = {index["name"] for index in inspect(connection).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing and (names is None or index.name in names):
+            index.create(bind=connection)
+
+
+def create_citizen_index(connection: Connection, index_name: str):
+    create_indexes(connection, Citizen.__table__, [index_name])
+
+
+def add_citizen_unique_index(connection: Connection):
+    # imports written before citizen_id was checked for uniqueness may
+    # repeat it, which of their rows is right is for a human to tell
+    citizens = Citizen.__table__
+    duplicated = connection.execute(
+        select([citizens.c.import_id])
+        .group_by(citizens.c.import_id, citizens.c.citizen_id)
+        .having(func.count() > 1)
+        .distinct()
+    )
+    import_ids = sorted(row.import_id for row in duplicated)
+    if import_ids:
+        raise RuntimeError(
+            f"imports {import_ids} have citizens with the same citizen_id, "
+            "remove the extra rows from citizen and restart"
+        )
+    create_citizen_index(connection, "ix_citizen_import_id_citizen_id")
+
+
+def redesign_citizen_indexes(connection: Connection):
+    # every lookup filters by import_id and citizen_id together,
+    # which ix_citizen_import_id_citizen_id already serves
+    for index_name in ["ix_citizen_id", "ix_citizen_import_id", "ix_citizen_citizen_id"]:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    create_citizen_index(connection, "ix_citizen_import_id_town_birth_date")
+
+
+def store_birth_date_as_date(connection: Connection):
+    if connection.dialect.name == "sqlite":
+        # sqlite has no column types to alter, only the stored values
+        connection.execute(text("UPDATE citizen SET birth_date = date(birth_date)"))
+    else:
+        connection.execute(text("ALTER TABLE citizen ALTER COLUMN birth_date TYPE DATE"))
+
+
+def add_import_updated_at(connection: Connection):
+    connection.execute(text('ALTER TABLE "import" ADD COLUMN updated_at TIMESTAMP'))
+    connection.execute(Import.__table__.update().values(updated_at=datetime.utcnow()))
+
+
+def add_import_created_at_and_deleted_at(connection: Connection):
+    connection.execute(text('ALTER TABLE "import" ADD COLUMN created_at TIMESTAMP'))
+    connection.execute(text('ALTER TABLE "import" ADD COLUMN deleted_at TIMESTAMP'))
+    imports = Import.__table__
+    created_at = func.coalesce(imports.c.updated_at, datetime.utcnow())
+    connection.execute(imports.update().values(created_at=created_at))
+
+
+def add_column(connection: Connection, table: str, column: str, column_type: str):
+    # a table missing before init_db is created by create_all with the column
+    if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def add_import_job_worker(connection: Connection):
+    add_column(connection, "importjob", "worker", "VARCHAR")
+
+
+def add_import_digest_content(connection: Connection):
+    add_column(connection, "importdigest", "content", "VARCHAR")
+
+
+def add_presents_citizen_index(connection: Connection):
+    create_indexes(connection, Presents.__table__)
+
+
+# append only: position in the list is the schema version it brings db to
+MIGRATIONS = [
+    add_import_version,
+    fill_presents,
+    add_citizen_unique_index,
+    store_birth_date_as_date,
+    redesign_citizen_indexes,
+    add_import_updated_at,
+    add_import_created_at_and_deleted_at,
+    add_import_job_worker,
+    add_import_digest_content,
+    add_presents_citizen_index,
+]
+
+
+def init_db(engine: Engine):
+    is_new_db = not engine.dialect.has_table(engine, "import")
+    with engine.connect() as connection:
+        if is_new_db and engine.dialect.name == "sqlite":
+            # lets purged imports' pages be given back by reclaim_space,
+            # it can't be changed once there are tables but with a VACUUM
+            connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        Base.metadata.create_all(bind=connection)
+        migrations_metadata.create_all(bind=connection)
+
+    with engine.begin() as connection:
+        version = connection.execute(select([func.max(schema_version.c.version)]))
+        version = version.scalar()
+        if version is None:
+            # create_all has just built the latest schema
+            version = len(MIGRATIONS) if is_new_db else 0
+            connection.execute(schema_version.insert().values(version=version))
+        for migration in MIGRATIONS[version:]:
+            migration(connection)
+        connection.execute(schema_version.update().values(version=len(MIGRATIONS)))
@@ -1,10 +1,138 @@
-from sqlalchemy import create_engine
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from app.core import config
+from app.core.instrumentation import instrument_engine
+from app.core.metrics import TimedQueuePool
+from app.db.shards import ShardedSession, ShardRouter
+
+database_url = make_url(config.database_url)
+is_sqlite = database_url.get_backend_name() == "sqlite"
+
+engine_options = {}
+if is_sqlite:
+    # a session may be used from threadpool threads, e.g. by streamed responses
+    engine_options["connect_args"] = {
+        "check_same_thread": False,
+        "timeout": config.sqlite_busy_timeout / 1000,
+    }
+else:
+    engine_options.update(
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_pre_ping=config.db_pool_pre_ping,
+        pool_recycle=config.db_pool_recycle,
+    )
+    if config.metrics:
+        engine_options["poolclass"] = TimedQueuePool
+
+SQLITE_PRODUCTION_PRAGMAS = [
+    # readers don't wait for the writer and vice versa
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={config.sqlite_mmap_size}",
+    f"PRAGMA cache_size=-{config.sqlite_cache_size_kib}",
+    f"PRAGMA busy_timeout={config.sqlite_busy_timeout}",
+]
+is_sqlite_production = is_sqlite and config.sqlite_profile == "production"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRODUCTION_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def new_engine(url: str, **options) -> Engine:
+    new = create_engine(url, **{**engine_options, **options})
+    if is_sqlite_production:
+        event.listen(new, "connect", set_sqlite_pragmas)
+    if config.instrumentation or config.profile_slow_request_ms:
+        instrument_engine(new)
+    return new
+
 
-engine = create_engine(config.database_url)  # , pool_pre_ping=True
+engine = new_engine(config.database_url)
 db_session = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine)
 )
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+shards: Optional[ShardRouter] = None
+if is_sqlite and config.sqlite_shards_dir:
+    shards = ShardRouter(
+        config.sqlite_shards_dir, new_engine, lock_files=is_sqlite_production
+    )
+    # statements of the main db commit on their own, see ShardedSession
+    autocommit_engine = new_engine(
+        config.database_url,
+        connect_args={**engine_options["connect_args"], "isolation_level": None},
+    )
+    Session = sessionmaker(
+        class_=ShardedSession,
+        shards=shards,
+        main_bind=autocommit_engine,
+        autocommit=False,
+        autoflush=False,
+        bind=engine,
+    )
+
+# short statements on the main db, committed at once while a session is
+# writing an import: with shards the import is written to its own file and
+# other databases have concurrent writers, but the only writer of a single
+# sqlite file is the import
+side_bind: Optional[Engine] = None
+if shards is not None:
+    side_bind = autocommit_engine
+elif not is_sqlite:
+    side_bind = engine
+
+
+_write_thread_lock = threading.Lock()
+
+
+@contextmanager
+def write_lock(import_id: Optional[int] = None):
+    # sqlite has a single writer: queue writers of this worker on a thread
+    # lock and, in production profile, writers of other workers on a file
+    # lock next to the db, instead of letting them fail with "database is locked";
+    # with shards, writers of import_id's rows in its file only queue
+    # behind each other
+    in_shard = shards is not None and import_id is not None
+    if in_shard and not shards.in_main_db(import_id):
+        with shards.write_lock(import_id):
+            yield
+        return
+    if not is_sqlite:
+        yield
+        return
+    with _write_thread_lock:
+        in_memory = not database_url.database or database_url.database == ":memory:"
+        if not is_sqlite_production or in_memory:
+            yield
+            return
+        with open(f"{database_url.database}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def import_write_lock():
+    # a new import is written to a file of its own, and its import row by
+    # a statement committed at once, so with shards imports don't queue
+    if shards is not None:
+        yield
+        return
+    with write_lock():
+        yield
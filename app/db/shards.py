@@ -0,0 +1,212 @@
+import fcntl
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Set
+
+from sqlalchemy import inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.util import find_tables
+
+from app.db.base import Base, Citizen, Import, Presents, Relations, ShardVersion
+from app.db.init_db import create_indexes
+
+# rows of one import, every import keeps them in a sqlite file of its own
+SHARDED_TABLES = [
+    Citizen.__table__,
+    Relations.__table__,
+    Presents.__table__,
+    ShardVersion.__table__,
+]
+# session.info key of the import whose file the sharded tables are read from
+IMPORT_ID_KEY = "import_id"
+# empty tables for imports without a file, e.g. missing or purged ones
+EMPTY_SHARD = "empty"
+
+
+def route_to_import(db: Session, import_id: Optional[int]):
+    db.info[IMPORT_ID_KEY] = import_id
+
+
+def imports_in_main_db(engine: Engine) -> Set[int]:
+    # imports stored before shards were turned on
+    citizens = Citizen.__table__
+    query = select([citizens.c.import_id]).distinct()
+    return {row.import_id for row in engine.execute(query)}
+
+
+class ShardRouter:
+    # files of the per-import dbs in `directory` and engines of the
+    # `max_engines` most recently used ones
+    def __init__(
+        self,
+        directory: str,
+        create_engine: Callable[[str], Engine],
+        max_engines: int = 256,
+        lock_files: bool = False,
+    ):
+        self.directory = directory
+        self.max_engines = max_engines
+        self.lock_files = lock_files
+        self._create_engine = create_engine
+        self._engines: "OrderedDict[object, Engine]" = OrderedDict()
+        self._lock = threading.Lock()
+        # writers of one import queue on one of these, keyed by import_id
+        self._write_locks = [threading.Lock() for _ in range(64)]
+        # imports whose rows were in the main db at startup, they are read,
+        # written and purged there
+        self.main_db_imports: Set[int] = set()
+
+    def path(self, name) -> str:
+        return os.path.join(self.directory, f"import_{name}.db")
+
+    def init(self, main_db_imports: Iterable[int] = ()):
+        os.makedirs(self.directory, exist_ok=True)
+        self.engine(None)
+        self.main_db_imports = set(main_db_imports)
+
+    def in_main_db(self, import_id: Optional[int]) -> bool:
+        # a purge in another worker doesn't update main_db_imports here, and
+        # a new import reusing the purged one's id has a file
+        return import_id in self.main_db_imports and not self.exists(import_id)
+
+    def _connect(self, name, mode: str) -> Engine:
+        # mode=rw fails instead of creating a file another worker has just
+        # unlinked, only create() makes new ones
+        url = f"sqlite:///file:{self.path(name)}?mode={mode}&uri=true"
+        return self._create_engine(url)
+
+    def _cached(self, name, engine: Engine) -> Engine:
+        with self._lock:
+            self._engines[name] = engine
+            while len(self._engines) > self.max_engines:
+                _, evicted = self._engines.popitem(last=False)
+                evicted.dispose()
+        return engine
+
+    def create(self, name) -> Engine:
+        engine = self._connect(name, "rwc")
+        Base.metadata.create_all(bind=engine, tables=SHARDED_TABLES)
+        engine.dispose()
+        return self._cached(name, self._connect(name, "rw"))
+
+    def engine(self, import_id: Optional[int]) -> Engine:
+        name = EMPTY_SHARD if import_id is None else import_id
+        with self._lock:
+            engine = self._engines.get(name)
+            if engine is not None:
+                self._engines.move_to_end(name)
+                return engine
+        if os.path.exists(self.path(name)):
+            engine = self._connect(name, "rw")
+            # tables and indexes added since the file was created
+            Base.metadata.create_all(bind=engine, tables=SHARDED_TABLES)
+            for table in SHARDED_TABLES:
+                create_indexes(engine, table)
+            return self._cached(name, engine)
+        if name == EMPTY_SHARD:
+            return self.create(EMPTY_SHARD)
+        return self.engine(None)
+
+    def exists(self, import_id: int) -> bool:
+        return os.path.exists(self.path(import_id))
+
+    def drop(self, import_id: int) -> bool:
+        # the whole import goes at once, whatever its size
+        with self._lock:
+            engine = self._engines.pop(import_id, None)
+        if engine is not None:
+            engine.dispose()
+        path = self.path(import_id)
+        existed = os.path.exists(path)
+        for suffix in ["", "-wal", "-shm", ".lock"]:
+            try:
+                os.unlink(path + suffix)
+            except FileNotFoundError:
+                pass
+        return existed
+
+    @contextmanager
+    def write_lock(self, import_id: int):
+        # like session.write_lock, but only for the writers of one import
+        with self._write_locks[import_id % len(self._write_locks)]:
+            if not self.lock_files or not self.exists(import_id):
+                yield
+                return
+            with open(f"{self.path(import_id)}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ShardedSession(Session):
+    # sharded tables are bound to the file of the import in
+    # info[IMPORT_ID_KEY], set by get_db or by inserting an import,
+    # the other tables to `main_bind`, whose statements commit at once:
+    # no transaction holds locks of the main db and of an import's file,
+    # so writers of different imports don't wait for each other. Rows of
+    # imports in ShardRouter.main_db_imports are bound to the main db, in
+    # transactions of `bind`
+    def __init__(self, shards: ShardRouter, main_bind: Engine, **kwargs):
+        super().__init__(**kwargs)
+        self.shards = shards
+        self.main_bind = main_bind
+        self._created_imports: List[int] = []
+
+    def get_bind(self, mapper=None, clause=None):
+        if mapper is not None:
+            tables = {inspect(mapper).local_table}
+        elif clause is not None:
+            tables = set(find_tables(clause, include_crud=True))
+        else:
+            return super().get_bind()
+        if tables.intersection(SHARDED_TABLES):
+            import_id = self.info.get(IMPORT_ID_KEY)
+            if self.shards.in_main_db(import_id):
+                return super().get_bind()
+            return self.shards.engine(import_id)
+        if tables:
+            return self.main_bind
+        return super().get_bind(mapper, clause)
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kwargs):
+        result = super().execute(clause, params, mapper, bind, **kwargs)
+        if isinstance(clause, Insert) and clause.table is Import.__table__:
+            # the import row is committed already, the import gets its file
+            # and the session writes its rows there
+            import_id = result.inserted_primary_key[0]
+            self._created_imports.append(import_id)
+            self.shards.create(import_id)
+            route_to_import(self, import_id)
+        return result
+
+    def commit(self):
+        super().commit()
+        self._created_imports.clear()
+
+    def rollback(self):
+        super().rollback()
+        self._abandon_created_imports()
+
+    def close(self):
+        super().close()
+        self._abandon_created_imports()
+
+    def _abandon_created_imports(self):
+        # their rows are gone with the transaction, the purger drops
+        # the files and the import rows
+        if not self._created_imports:
+            return
+        imports = Import.__table__
+        self.main_bind.execute(
+            imports.update()
+            .where(imports.c.import_id.in_(self._created_imports))
+            .values(deleted_at=datetime.utcnow())
+        )
+        self._created_imports.clear()
@@ -1,6 +1,15 @@
+from datetime import datetime
 from typing import List
 
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -8,30 +17,77 @@ from app.db.base_class import Base
 
 class Import(Base):
     import_id = Column(Integer, primary_key=True)
+    # bumped on every change of the import's citizens
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # utc time of the import or of the last change of its citizens
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # set by DELETE or when retention expires, rows of the import are
+    # then purged in batches and the import row goes last
+    deleted_at = Column(DateTime)
+
+
+class ShardVersion(Base):
+    # with shards, version and change time of an import's rows, kept in the
+    # import's file and bumped in the transaction changing them; ETags and
+    # cached results go by it instead of Import.version
+    import_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
 
 
 class Relations(Base):
     import_id = Column(Integer, primary_key=True)
-    citizen_id = Column(Integer, ForeignKey("citizen.citizen_id"), primary_key=True)
-    relative_citizen_id = Column(
-        Integer, ForeignKey("citizen.citizen_id"), primary_key=True
+    citizen_id = Column(Integer, primary_key=True)
+    relative_citizen_id = Column(Integer, primary_key=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["import_id", "citizen_id"], ["citizen.import_id", "citizen.citizen_id"]
+        ),
+        ForeignKeyConstraint(
+            ["import_id", "relative_citizen_id"],
+            ["citizen.import_id", "citizen.citizen_id"],
+        ),
     )
 
 
 class Citizen(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
 
-    import_id = Column(Integer, index=True)
-    citizen_id = Column(Integer, index=True)
+    import_id = Column(Integer)
+    citizen_id = Column(Integer)
 
     town = Column(String)
     street = Column(String)
     building = Column(String)
     apartment = Column(Integer)
     name = Column(String)
-    birth_date = Column(DateTime)
+    birth_date = Column(Date)
     gender = Column(String)
     relatives: List[Relations] = relationship(
         "Relations",
         primaryjoin="and_(Citizen.import_id == Relations.import_id, Citizen.citizen_id == Relations.citizen_id)",
     )
+
+    __table_args__ = (
+        # citizen_id is unique inside of an import, relations reference it
+        Index("ix_citizen_import_id_citizen_id", "import_id", "citizen_id", unique=True),
+        # covers age stats: the whole query is answered from the index
+        Index("ix_citizen_import_id_town_birth_date", "import_id", "town", "birth_date"),
+    )
+
+
+class Presents(Base):
+    # materialized birthdays calendar: how many presents citizen_id buys
+    # in month, kept in sync by import_users and update_citizen
+    import_id = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    citizen_id = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # the primary key serves the calendar in month order, this the
+        # rows of the citizens a PATCH changes
+        Index("ix_presents_import_id_citizen_id", "import_id", "citizen_id"),
+    )
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String
+
+from app.db.base_class import Base
+
+
+class ImportDigest(Base):
+    # "sha256:<hex>" of an import's citizens or "key:<hex>" of the
+    # Idempotency-Key header it was posted with
+    digest = Column(String, primary_key=True)
+    import_id = Column(Integer, nullable=False)
+    # import version the content digest was computed for, a PATCHed import
+    # no longer matches it; None for keys, which match whatever the version
+    version = Column(Integer)
+    # for keys, KeyContent of the citizens posted with the key, a reuse of
+    # the key with other citizens is refused; None for content digests
+    content = Column(String)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String
+
+from app.db.base_class import Base
+
+
+class ImportJob(Base):
+    # asynchronous POST /imports: validating -> importing -> done | failed
+    job_id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False)
+    citizens_total = Column(Integer)
+    citizens_done = Column(Integer, nullable=False, default=0, server_default="0")
+    import_id = Column(Integer)
+    error = Column(String)
+    # host:pid of the process running the job
+    worker = Column(String)
@@ -1,109 +1,467 @@
-from fastapi import FastAPI, Body, Depends
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from itertools import chain, islice
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from fastapi import FastAPI, Body, Depends, Header
 from fastapi.exceptions import RequestValidationError, HTTPException
+from fastapi.openapi.constants import REF_PREFIX
+from prometheus_client import CONTENT_TYPE_LATEST
+from pydantic.schema import schema as models_schema
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
-from starlette.responses import Response, PlainTextResponse
+from starlette.responses import Response, PlainTextResponse, StreamingResponse
+from starlette.types import Scope
 from sqlalchemy.orm import Session
 
 from app.models.citizen import (
+    ImportValidationError,
+    iter_validated_batches,
+    validate_citizens_import,
     CitizensImportsIn,
     CitizensImportsOut,
     CitizenUpdateIn,
+    CitizenBulkUpdateIn,
+    CitizenUpdateError,
     CitizenUpdateOut,
     CitizensGetOut,
     CitizensPresentsOut,
     CitizensAgeStatsOut,
 )
+from app.models.import_job import ImportJobOut
 from app.tests.api.v1.tests_configs.import_citizens_config import simple_import_data
 from app.crud.citizen import (
     import_users,
-    get_citizens_by_import_id,
+    import_users_in_batches,
+    get_citizens_data,
+    iter_citizens_data,
     update_citizen,
+    update_citizens,
+    CitizenNotFoundError,
     get_citizen,
     get_citizens_presents,
     get_age_stats_by_town,
+    get_import_state,
+)
+from app.crud.import_digest import (
+    IdempotencyKeyReusedError,
+    KeyContent,
+    find_import,
+    import_once,
+    key_digest,
+    request_digests,
+)
+from app.crud.import_retention import delete_import, is_deleted_import
+from app.crud.import_job import (
+    create_import_job,
+    fail_abandoned_import_jobs,
+    get_import_job,
+)
+from app.crud.snapshot import get_import_snapshot, snapshots_stats
+from app.core import config
+from app.core.cache import import_cache
+from app.core.compression import CompressionMiddleware
+from app.core.instrumentation import SlowRequestProfiler, handler_done, phase
+from app.core.metrics import render_metrics
+from app.core.middleware import (
+    ConditionalGetMiddleware,
+    DBSessionMiddleware,
+    MetricsMiddleware,
+)
+from app.core.import_purger import import_purger
+from app.core.import_jobs import (
+    WORKER,
+    import_progress,
+    is_running_job_worker,
+    shutdown_import_jobs,
+    submit_import_job,
 )
-from app.db.session import Session, engine
-from app.db.base_class import Base
+from app.core.json_stream import JSONStreamError, iter_json_array
+from app.core.responses import TrustedJSONResponse, encode_citizens, format_date
+from app.db.session import Session, engine, import_write_lock, shards, write_lock
+from app.db.shards import imports_in_main_db, route_to_import
+from app.db.init_db import init_db
+from app.db_models.citizen import Import
 
-Base.metadata.create_all(bind=engine)
+with write_lock():
+    init_db(engine)
+    if shards is not None:
+        shards.init(imports_in_main_db(engine))
 app = FastAPI()
 
+profiler = None
+if config.profile_slow_request_ms:
+    profiler = SlowRequestProfiler(
+        config.profile_slow_request_ms / 1000,
+        config.profile_interval_ms / 1000,
+        config.profile_dir,
+    )
+
+
+@app.on_event("startup")
+async def bound_db_threadpool():
+    # handlers talking to the db are plain `def`s, so they are run in the
+    # loop's default executor instead of blocking it
+    loop = asyncio.get_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=config.db_threads))
+
+
+@app.on_event("startup")
+def fail_import_jobs_of_stopped_workers():
+    db = Session()
+    try:
+        with write_lock():
+            fail_abandoned_import_jobs(db, is_running_job_worker)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_background_threads():
+    import_purger.start()
+    if profiler is not None:
+        profiler.start()
+
+
+@app.on_event("shutdown")
+def finish_import_jobs():
+    shutdown_import_jobs()
+    import_purger.stop()
+    if profiler is not None:
+        profiler.stop()
+
 
 @app.exception_handler(RequestValidationError)
+@app.exception_handler(ImportValidationError)
+@app.exception_handler(CitizenUpdateError)
+@app.exception_handler(JSONStreamError)
 async def validation_exception_handler(request, exc):
     return PlainTextResponse(str(exc), status_code=400)
 
 
-@app.middleware("http")
-async def db_session_middleware(request: Request, call_next):
-    response = Response("Internal server error", status_code=500)
-    try:
-        request.state.db = Session()
-        response = await call_next(request)
-    finally:
-        request.state.db.close()
-    return response
+@app.exception_handler(IdempotencyKeyReusedError)
+async def idempotency_key_reused_handler(request, exc):
+    return PlainTextResponse(str(exc), status_code=422)
+
+
+# added first, so it runs inside DBSessionMiddleware, with the session
+app.add_middleware(ConditionalGetMiddleware, get_import_state=get_import_state)
+app.add_middleware(
+    DBSessionMiddleware,
+    session_factory=Session,
+    instrumented=config.instrumentation,
+    profiler=profiler,
+)
+
+
+def route_path(scope: Scope) -> str:
+    # route templates, not paths, keep the number of label values bounded
+    paths = {route.endpoint: route.path for route in app.routes}
+    return paths.get(scope.get("endpoint"), "unmatched")
+
+
+if config.metrics:
+    app.add_middleware(MetricsMiddleware, route_of=route_path)
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+# added last, so it's the outermost one and compresses whatever is sent
+if config.compress_responses:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.compress_minimum_size,
+        gzip_level=config.gzip_level,
+        brotli_quality=config.brotli_quality,
+    )
 
 
 # Dependency
 def get_db(request: Request):
-    return request.state.db
+    db = request.state.db
+    if shards is not None and "import_id" in request.path_params:
+        # the session reads and writes citizens in the file of this import
+        try:
+            route_to_import(db, int(request.path_params["import_id"]))
+        except ValueError:
+            pass
+    return db
+
+
+# no import has this id
+MISSING_IMPORT_ID = 0
+
+
+# Dependency
+def visible_import_id(import_id: int, db: Session = Depends(get_db)) -> int:
+    # a deleted import reads as a missing one while its rows are being purged
+    if not is_deleted_import(db, import_id):
+        return import_id
+    route_to_import(db, MISSING_IMPORT_ID)
+    return MISSING_IMPORT_ID
+
+
+def respond(data: Any):
+    if config.fast_responses:
+        with phase("serialization"):
+            return TrustedJSONResponse(data)
+    handler_done()
+    return {"data": data}
+
+
+def respond_citizens(citizens: List[Dict]):
+    if config.fast_responses:
+        with phase("serialization"):
+            return TrustedJSONResponse(encode_citizens(citizens))
+    handler_done()
+    return {"data": citizens}
 
 
 # 1
-@app.post("/imports", response_model=CitizensImportsOut)
-async def import_citizens(
-    citizens: CitizensImportsIn = Body(..., example=simple_import_data),
+def import_citizens(
+    payload: dict = Body(...),
+    idempotency_key: str = Header(None),
     db: Session = Depends(get_db),
 ):
-    return {"data": import_users(db, citizens.citizens)}
+    # plain dict: citizens are validated in bulk, not one pydantic model each
+    with phase("validation"):
+        citizens = validate_citizens_import(payload)
+    digests = []
+    if config.dedupe_imports:
+        digests = request_digests(citizens, idempotency_key)
+    with import_write_lock():
+        db_import = import_once(
+            db,
+            digests,
+            lambda: import_users(db, citizens),
+            lambda: KeyContent(citizens).hexdigest(),
+        )
+    return {"data": db_import}
+
+
+def iter_sync(chunks: AsyncIterator[bytes], loop, timeout: float) -> Iterator[bytes]:
+    # lets a threadpool thread read the request body from the event loop,
+    # waiting for every chunk `timeout` s at most
+    while True:
+        future = asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop)
+        try:
+            chunk = future.result(timeout)
+        except StopAsyncIteration:
+            return
+        except TimeoutError:
+            future.cancel()
+            raise HTTPException(status_code=408, detail="Request body timed out")
+        yield chunk
+
+
+async def import_citizens_streamed(
+    request: Request, idempotency_key: str = Header(None), db: Session = Depends(get_db)
+):
+    loop = asyncio.get_event_loop()
+    # citizens are hashed only once all of them are known, too late
+    # to skip writing them, so only the key is looked up
+    digests = []
+    if config.dedupe_imports and idempotency_key:
+        digests = [key_digest(idempotency_key)]
+
+    def import_stream():
+        body = iter_sync(request.stream(), loop, config.stream_read_timeout)
+        citizens = iter_json_array(body, "citizens")
+        key_content = KeyContent()
+        batches = key_content.tracked(
+            iter_validated_batches(citizens, config.import_chunk_size)
+        )
+
+        def content() -> str:
+            # the rest of the body, unless it's written already
+            for _ in batches:
+                pass
+            return key_content.hexdigest()
+
+        # a retry is checked against the key's citizens without the lock
+        import_id = find_import(db, digests, content)
+        if import_id is not None:
+            return Import(import_id=import_id)
+        # the write lock is taken once the first batch is received and valid,
+        # past it a stalled client holds it stream_read_timeout s at most
+        batches = chain(list(islice(batches, 1)), batches)
+        with import_write_lock():
+            return import_once(
+                db, digests, lambda: import_users_in_batches(db, batches), content
+            )
+
+    # parsing, validation and writes share one thread and one transaction,
+    # the body is read from the client only as fast as it is written
+    return {"data": await run_in_threadpool(import_stream)}
+
+
+async def import_citizens_job(
+    request: Request, idempotency_key: str = Header(None), db: Session = Depends(get_db)
+):
+    body = b"".join([chunk async for chunk in request.stream()])
+
+    def create_job():
+        with write_lock():
+            return create_import_job(db, WORKER)
+
+    job = await run_in_threadpool(create_job)
+    submit_import_job(
+        job.job_id, body, idempotency_key if config.dedupe_imports else None
+    )
+    return {"data": job}
+
+
+if config.import_jobs:
+    app.post("/imports", response_model=ImportJobOut, status_code=202)(
+        import_citizens_job
+    )
+else:
+    app.post("/imports", response_model=CitizensImportsOut)(
+        import_citizens_streamed if config.stream_imports else import_citizens
+    )
+
+
+@app.get("/imports/jobs/{job_id}", response_model=ImportJobOut)
+def get_import_job_status(job_id: int, db: Session = Depends(get_db)):
+    job = get_import_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    citizens_done = import_progress.get(job_id, job.citizens_done)
+    return {"data": {**vars(job), "citizens_done": citizens_done}}
 
 
 # 2
 @app.patch(
     "/imports/{import_id}/citizens/{citizen_id}", response_model=CitizenUpdateOut
 )
-async def update_citizen_info(
-    import_id: int,
+def update_citizen_info(
     citizen_id: int,
+    import_id: int = Depends(visible_import_id),
     citizen_update_fields: CitizenUpdateIn = Body(...),
     db: Session = Depends(get_db),
 ):
-    db_citizen = get_citizen(db, import_id, citizen_id)
-    print(citizen_update_fields)
-    if not db_citizen:
-        raise HTTPException(status_code=404, detail="Item not found")
-    updated_citizen = update_citizen(db, db_citizen, citizen_update_fields)
+    with write_lock(import_id):
+        db_citizen = get_citizen(db, import_id, citizen_id)
+        if not db_citizen:
+            raise HTTPException(status_code=404, detail="Item not found")
+        updated_citizen = update_citizen(db, db_citizen, citizen_update_fields)
     updated_citizen = {
         **vars(updated_citizen),
         **{"relatives": [rel.relative_citizen_id for rel in updated_citizen.relatives]},
     }
+    if config.fast_responses:
+        return TrustedJSONResponse(encode_citizens([updated_citizen])[0])
     return {"data": updated_citizen}
 
 
+@app.patch("/imports/{import_id}/citizens", response_model=CitizensGetOut)
+def update_citizens_info(
+    import_id: int = Depends(visible_import_id),
+    citizens_update_fields: List[CitizenBulkUpdateIn] = Body(...),
+    db: Session = Depends(get_db),
+):
+    # same as PATCHing the citizens one by one, in one transaction
+    with write_lock(import_id):
+        try:
+            updated_citizens = update_citizens(db, import_id, citizens_update_fields)
+        except CitizenNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    return respond_citizens(updated_citizens)
+
+
+@app.delete("/imports/{import_id}", status_code=204)
+def delete_citizens_import(import_id: int, db: Session = Depends(get_db)):
+    # answers at once, the import's rows are purged in the background
+    with write_lock():
+        deleted = delete_import(db, import_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Import not found")
+    import_purger.wake()
+    return Response(status_code=204)
+
+
+def stream_citizens_json(citizens: Iterator[Dict]) -> Iterator[bytes]:
+    yield b'{"data":['
+    batch, separator = [], ""
+    for citizen in citizens:
+        citizen["birth_date"] = format_date(citizen["birth_date"])
+        batch.append(json.dumps(citizen, ensure_ascii=False, separators=(",", ":")))
+        if len(batch) >= config.stream_batch_size:
+            yield (separator + ",".join(batch)).encode()
+            batch, separator = [], ","
+    if batch:
+        yield (separator + ",".join(batch)).encode()
+    yield b"]}"
+
+
 # 3
 @app.get("/imports/{import_id}/citizens", response_model=CitizensGetOut)
-async def get_citizens(import_id: int, db: Session = Depends(get_db)):
-    citizens = get_citizens_by_import_id(db, import_id)
-    citizens = [
-        {
-            **vars(citizen),
-            **{"relatives": [rel.relative_citizen_id for rel in citizen.relatives]},
-        }
-        for citizen in citizens
-    ]
-    return {"data": citizens}
+def get_citizens(
+    import_id: int = Depends(visible_import_id), db: Session = Depends(get_db)
+):
+    if config.snapshot_reads:
+        snapshot = get_import_snapshot(db, import_id)
+        return Response(snapshot.citizens_json(), media_type="application/json")
+    if config.stream_citizens:
+        return StreamingResponse(
+            stream_citizens_json(iter_citizens_data(db, import_id)),
+            media_type="application/json",
+        )
+    return respond_citizens(get_citizens_data(db, import_id))
 
 
 # 4
 @app.get("/imports/{import_id}/citizens/birthdays", response_model=CitizensPresentsOut)
-async def get_citizens_presents_calendar(import_id: int, db: Session = Depends(get_db)):
-    return {"data": get_citizens_presents(db, import_id)}
+def get_citizens_presents_calendar(
+    import_id: int = Depends(visible_import_id), db: Session = Depends(get_db)
+):
+    if config.snapshot_reads:
+        return respond(get_import_snapshot(db, import_id).presents())
+    return respond(get_citizens_presents(db, import_id))
 
 
 # 5
 @app.get(
     "/imports/{import_id}/towns/stat/percentile/age", response_model=CitizensAgeStatsOut
 )
-async def get_citizens_age_stats(import_id: int, db: Session = Depends(get_db)):
-    return {"data": get_age_stats_by_town(db, import_id)}
+def get_citizens_age_stats(
+    import_id: int = Depends(visible_import_id), db: Session = Depends(get_db)
+):
+    if config.snapshot_reads:
+        return respond(get_import_snapshot(db, import_id).age_stats())
+    return respond(get_age_stats_by_town(db, import_id))
+
+
+@app.get("/cache/stats", include_in_schema=False)
+async def get_cache_stats():
+    return {"data": {**import_cache.stats(), "snapshots": snapshots_stats()}}
+
+
+def openapi() -> Dict:
+    # POST /imports bodies are validated in bulk as a plain dict (or not parsed
+    # by fastapi at all with streamed imports and jobs), CitizensImportsIn
+    # still documents them
+    if app.openapi_schema:
+        return app.openapi_schema
+    schema = FastAPI.openapi(app)
+    definitions = models_schema([CitizensImportsIn], ref_prefix=REF_PREFIX)
+    schema.setdefault("components", {}).setdefault("schemas", {}).update(
+        definitions["definitions"]
+    )
+    schema["paths"]["/imports"]["post"]["requestBody"] = {
+        "content": {
+            "application/json": {
+                "schema": {"$ref": f"{REF_PREFIX}CitizensImportsIn"},
+                "example": simple_import_data,
+            }
+        },
+        "required": True,
+    }
+    app.openapi_schema = schema
+    return schema
+
+
+app.openapi = openapi
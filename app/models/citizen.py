@@ -1,5 +1,7 @@
-from datetime import datetime
-from typing import List, Optional, Tuple
+import json
+import re
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from pydantic import BaseModel, validator, Schema, conlist, Extra
 
@@ -11,9 +13,9 @@ class Citizen(BaseModel):
     building: str = Schema(..., min_length=1, max_length=256)
     apartment: int = Schema(..., gt=0)
     name: str = Schema(..., min_length=1, max_length=256)
-    birth_date: datetime = Schema(...)
+    birth_date: date = Schema(...)
     gender: str = Schema(..., regex="^(male|female)$")
-    relatives: List[int] = Schema([])  # todo: validate by whole set somehow
+    relatives: List[int] = Schema([])  # whole set is checked by validate_citizens_import
 
 
 class CitizenIn(Citizen):
@@ -21,8 +23,8 @@ class CitizenIn(Citizen):
     def validate_birth_date(cls, birth_date: str):  # noqa: cls/self in pydantic
         birth_date = datetime.strptime(birth_date, "%d.%m.%Y")
         if birth_date > datetime.today():
-            raise ValueError("birth_date can't be less than today")
-        return birth_date
+            raise ValueError("birth_date can't be greater than today")
+        return birth_date.date()
 
     class Config:
         extra = Extra.forbid
@@ -33,6 +35,214 @@ class CitizensImportsIn(BaseModel):
     citizens: conlist(CitizenIn, min_items=1)
 
 
+class ImportValidationError(ValueError):
+    pass
+
+
+# fullmatch: "$" would let a trailing "\n" through
+BIRTH_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int
+
+
+def _is_positive_int(value: Any) -> bool:
+    return type(value) is int and value > 0
+
+
+def _is_text(value: Any) -> bool:
+    return type(value) is str and 0 < len(value) <= 256
+
+
+def _is_gender(value: Any) -> bool:
+    return value == "male" or value == "female"
+
+
+def _is_int_list(value: Any) -> bool:
+    return type(value) is list and all(map(_is_int, value))
+
+
+# coercions of pydantic's int and str fields, like CitizenIn does
+def _as_int(value: Any) -> int:
+    return int(value)
+
+
+def _as_text(value: Any) -> str:
+    if isinstance(value, (int, float)):
+        return str(value)
+    raise TypeError(value)
+
+
+def _as_int_list(value: Any) -> List[int]:
+    if type(value) is not list:
+        raise TypeError(value)
+    return [value if type(value) is int else int(value) for value in value]
+
+
+# field -> (check, coercion of a value failing it, error message)
+CITIZEN_FIELD_CHECKS: Dict[str, Tuple[Callable[[Any], bool], Callable, str]] = {
+    "citizen_id": (_is_positive_int, _as_int, "positive integer expected"),
+    "town": (_is_text, _as_text, "string of 1 to 256 characters expected"),
+    "street": (_is_text, _as_text, "string of 1 to 256 characters expected"),
+    "building": (_is_text, _as_text, "string of 1 to 256 characters expected"),
+    "apartment": (_is_positive_int, _as_int, "positive integer expected"),
+    "name": (_is_text, _as_text, "string of 1 to 256 characters expected"),
+    "gender": (_is_gender, _as_text, "male or female expected"),
+    "relatives": (_is_int_list, _as_int_list, "list of integers expected"),
+}
+CITIZEN_FIELDS = set(CITIZEN_FIELD_CHECKS) | {"birth_date"}
+
+
+def _error(index: int, field: str, message: str) -> ImportValidationError:
+    return ImportValidationError(f"citizens -> {index} -> {field}\n  {message}")
+
+
+def _parse_birth_dates(citizens: List[Dict], offset: int = 0) -> List[date]:
+    today = date.today()
+    birth_dates = []
+    for index, citizen in enumerate(citizens, offset):
+        value = citizen["birth_date"]
+        match = BIRTH_DATE_RE.fullmatch(value) if type(value) is str else None
+        try:
+            day, month, year = map(int, match.groups())
+            birth_date = date(year, month, day)
+        except (AttributeError, ValueError):
+            raise _error(index, "birth_date", "date in DD.MM.YYYY format expected")
+        if birth_date > today:
+            raise _error(index, "birth_date", "birth_date can't be greater than today")
+        birth_dates.append(birth_date)
+    return birth_dates
+
+
+def validate_citizens_batch(citizens: List[Any], offset: int = 0) -> List[Dict]:
+    # field rules of CitizenIn checked column by column over plain json,
+    # birth_date is parsed in place; `offset` is the index of the first one
+    for index, citizen in enumerate(citizens, offset):
+        if type(citizen) is not dict:
+            raise ImportValidationError(f"citizens -> {index}\n  object expected")
+        citizen.setdefault("relatives", [])
+        if citizen.keys() != CITIZEN_FIELDS:
+            missing = sorted(CITIZEN_FIELDS - citizen.keys())
+            extra = sorted(citizen.keys() - CITIZEN_FIELDS)
+            raise ImportValidationError(
+                f"citizens -> {index}\n  missing fields: {missing}, extra fields: {extra}"
+            )
+
+    for field, (check, coerce, message) in CITIZEN_FIELD_CHECKS.items():
+        if all(check(citizen[field]) for citizen in citizens):
+            continue
+        # values pydantic accepts, like "1" or 1.0 for an int or 1 for a
+        # string, are converted the way it does, the rest are errors
+        for index, citizen in enumerate(citizens, offset):
+            value = citizen[field]
+            if check(value):
+                continue
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError, OverflowError):
+                raise _error(index, field, message)
+            if not check(value):
+                raise _error(index, field, message)
+            citizen[field] = value
+    for citizen, birth_date in zip(citizens, _parse_birth_dates(citizens, offset)):
+        citizen["birth_date"] = birth_date
+    return citizens
+
+
+class CitizensSetValidator:
+    # whole set rules, checked batch by batch: unique citizen_id, relatives
+    # are other citizens of the same import and are symmetric.
+    # Only relations whose reverse is not seen yet are kept, so in
+    # the end every relation left is asymmetric or to an unknown citizen
+    def __init__(self):
+        self.citizen_ids: Set[int] = set()
+        self.unmatched: Set[Tuple[int, int]] = set()
+
+    def add(self, citizens: List[Dict], offset: int = 0) -> List[Tuple[int, int]]:
+        # returns relations (both directions) complete with this batch
+        matched = []
+        for index, citizen in enumerate(citizens, offset):
+            citizen_id, relatives = citizen["citizen_id"], citizen["relatives"]
+            if citizen_id in self.citizen_ids:
+                raise _error(index, "citizen_id", "citizen_id must be unique")
+            self.citizen_ids.add(citizen_id)
+            if len(relatives) != len(set(relatives)):
+                raise _error(index, "relatives", "relatives must be unique")
+            for relative_id in relatives:
+                if relative_id == citizen_id:
+                    raise _error(index, "relatives", "citizen can't be own relative")
+                if (relative_id, citizen_id) in self.unmatched:
+                    self.unmatched.remove((relative_id, citizen_id))
+                    matched.append((citizen_id, relative_id))
+                    matched.append((relative_id, citizen_id))
+                else:
+                    self.unmatched.add((citizen_id, relative_id))
+        return matched
+
+    def close(self):
+        if not self.citizen_ids:
+            raise ImportValidationError("citizens\n  non empty list expected")
+        for citizen_id, relative_id in sorted(self.unmatched):
+            if relative_id not in self.citizen_ids:
+                message = f"unknown relative {relative_id} of citizen {citizen_id}"
+            else:
+                message = (
+                    f"citizen {relative_id} is a relative of {citizen_id}, "
+                    f"but not vice versa"
+                )
+            raise ImportValidationError(f"citizens\n  {message}")
+
+
+def _payload_citizens(payload: Any) -> List[Any]:
+    citizens = payload.get("citizens") if type(payload) is dict else None
+    if type(citizens) is not list or not citizens:
+        raise ImportValidationError("citizens\n  non empty list expected")
+    return citizens
+
+
+def validate_citizens_import(payload: Any) -> List[Dict]:
+    # same rules as CitizensImportsIn plus the whole set rules,
+    # returns the same citizens with birth_date parsed in place
+    citizens = _payload_citizens(payload)
+    validate_citizens_batch(citizens)
+    validator = CitizensSetValidator()
+    validator.add(citizens)
+    validator.close()
+    return citizens
+
+
+def iter_validated_batches(
+    citizens: Iterable[Any], batch_size: int
+) -> Iterator[Tuple[List[Dict], List[Tuple[int, int]]]]:
+    # validate_citizens_import over a stream of citizens: yields validated
+    # batches with relations complete so far, raises at the end if the
+    # whole set is invalid
+    validator = CitizensSetValidator()
+    batch, offset = [], 0
+    for citizen in citizens:
+        batch.append(citizen)
+        if len(batch) >= batch_size:
+            validate_citizens_batch(batch, offset)
+            yield batch, validator.add(batch, offset)
+            batch, offset = [], offset + len(batch)
+    if batch:
+        validate_citizens_batch(batch, offset)
+        yield batch, validator.add(batch, offset)
+    validator.close()
+
+
+def validate_citizens_import_body(
+    body: bytes, batch_size: int
+) -> List[Tuple[List[Dict], List[Tuple[int, int]]]]:
+    # raw POST /imports body to batches ready for import_users_in_batches
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise ImportValidationError("body is not valid json")
+    return list(iter_validated_batches(_payload_citizens(payload), batch_size))
+
+
 class CitizensImportsOutData(BaseModel):
     import_id: int
 
@@ -51,21 +261,30 @@ class CitizenUpdateIn(BaseModel):
     building: str = Schema(None, min_length=1, max_length=256)
     apartment: int = Schema(None, gt=0)
     name: str = Schema(None, min_length=1, max_length=256)
-    birth_date: str = None
+    birth_date: date = None
     gender: str = Schema(None, regex="^(male|female)$")
     relatives: List[int] = None
 
     @validator("birth_date", pre=True)
     def validate_birth_date(cls, birth_date: str):  # noqa: cls/self in pydantic
         birth_date = datetime.strptime(birth_date, "%d.%m.%Y")
-        if birth_date < datetime.today():
-            raise ValueError("birth_date can't be less than today")
-        return birth_date
+        if birth_date > datetime.today():
+            raise ValueError("birth_date can't be greater than today")
+        return birth_date.date()
 
     class Config:
         extra = Extra.forbid
 
 
+# PATCH /imports/{import_id}/citizens: a list of these, applied in order
+class CitizenBulkUpdateIn(CitizenUpdateIn):
+    citizen_id: int = Schema(..., gt=0)
+
+
+class CitizenUpdateError(ValueError):
+    pass
+
+
 def validate_citizen_update(citizen: CitizenUpdateIn) -> Tuple[bool, Optional[str]]:
     if len(citizen.dict()) < 1:
         return True, "You must specify at least 1 field"
@@ -76,7 +295,7 @@ class CitizenUpdateOut(BaseModel):
     data: Citizen
 
     class Config:
-        json_encoders = {datetime: lambda v: v.strftime("%d.%m.%Y")}
+        json_encoders = {date: lambda v: v.strftime("%d.%m.%Y")}
 
 
 # /imports/{import_id}/citizens
@@ -84,7 +303,7 @@ class CitizensGetOut(BaseModel):
     data: List[Citizen]
 
     class Config:
-        json_encoders = {datetime: lambda v: v.strftime("%d.%m.%Y")}
+        json_encoders = {date: lambda v: v.strftime("%d.%m.%Y")}
 
 
 # /imports/{import_id}/citizens/birthdays
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+
+# /imports/jobs/{job_id}
+class ImportJobOutData(BaseModel):
+    job_id: int
+    status: str
+    citizens_total: int = None
+    citizens_done: int
+    import_id: int = None
+    error: str = None
+
+    class Config:
+        orm_mode = True
+
+
+class ImportJobOut(BaseModel):
+    data: ImportJobOutData
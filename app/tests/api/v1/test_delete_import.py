@@ -0,0 +1,33 @@
+import requests
+
+from app.tests.utils import get_server_api
+from app.tests.api_functions import import_citizens
+from app.tests.api.v1.tests_configs import import_citizens_config as c
+
+
+endpoint = "/imports/{import_id}"
+
+
+def test_delete_import():
+    import_id = import_citizens(c.simple_import_data)
+    url = f"{get_server_api()}{endpoint.format(import_id=import_id)}"
+    assert requests.get(f"{url}/citizens").json()["data"]
+
+    response = requests.delete(url)
+    assert response.status_code == 204
+    assert response.content == b""
+
+    # as if there never was such an import
+    assert requests.get(f"{url}/citizens").json() == {"data": []}
+    assert requests.get(f"{url}/towns/stat/percentile/age").json() == {"data": []}
+    presents = requests.get(f"{url}/citizens/birthdays").json()["data"]
+    assert all(citizens == [] for citizens in presents.values())
+    response = requests.patch(f"{url}/citizens/1", json={"name": "Петров"})
+    assert response.status_code == 404
+    assert requests.delete(url).status_code == 404
+
+
+def test_delete_not_existent_import():
+    response = requests.delete(f"{get_server_api()}{endpoint.format(import_id=-1)}")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Import not found"}
@@ -1,3 +1,4 @@
+import time
 from datetime import date, timedelta
 
 import pytest
@@ -34,3 +35,75 @@ def test_wrong_import_id():
     response = requests.get(f"{server_api}{endpoint.format(import_id=import_id)}")
     assert response.status_code == 200
     assert response.json() == {"data": []}
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/citizens", "/citizens/birthdays", "/towns/stat/percentile/age"],
+)
+def test_conditional_get(path):
+    import_id = import_citizens(import_c.simple_import_data)
+    url = f"{get_server_api()}/imports/{import_id}{path}"
+    response = requests.get(url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = requests.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    response = requests.patch(
+        f"{get_server_api()}/imports/{import_id}/citizens/1", json={"name": "Петров"}
+    )
+    assert response.status_code == 200
+    response = requests.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_modified_since(import_fixture):
+    url = f"{get_server_api()}{endpoint.format(import_id=import_fixture)}"
+    # Last-Modified is sent once the second of the last change is over
+    time.sleep(1)
+    last_modified = requests.get(url).headers["Last-Modified"]
+    response = requests.get(url, headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    response = requests.get(
+        url, headers={"If-Modified-Since": "Mon, 01 Jan 2018 00:00:00 GMT"}
+    )
+    assert response.status_code == 200
+
+
+def test_if_modified_since_after_patches_within_a_second():
+    import_id = import_citizens(import_c.simple_import_data)
+    url = f"{get_server_api()}{endpoint.format(import_id=import_id)}"
+    time.sleep(1)
+    last_modified = requests.get(url).headers["Last-Modified"]
+    for name in ["Петров", "Сидоров"]:
+        response = requests.patch(f"{url}/1", json={"name": name})
+        assert response.status_code == 200
+        response = requests.get(url, headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 200
+        assert response.json()["data"][0]["name"] == name
+        # none within the second of the PATCH, the next one is later anyway
+        last_modified = response.headers.get("Last-Modified", last_modified)
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/citizens", "/citizens/birthdays", "/towns/stat/percentile/age"],
+)
+def test_server_timing(import_fixture, path):
+    url = f"{get_server_api()}/imports/{import_fixture}{path}"
+    response = requests.get(url)
+    if "Server-Timing" not in response.headers:
+        pytest.skip("server runs without instrumentation")
+    metrics = dict(
+        metric.strip().split(";", 1)
+        for metric in response.headers["Server-Timing"].split(",")
+    )
+    assert set(metrics) >= {"db", "total"}
+    statements = int(metrics["db"].split('desc="')[1].split(" ")[0])
+    # a few queries whatever the size of the import, no N+1
+    assert 0 < statements <= 5
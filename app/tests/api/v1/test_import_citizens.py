@@ -1,8 +1,10 @@
+from copy import deepcopy
 from datetime import date, timedelta
 
 import pytest
 import requests
 
+from app.tests.api_functions import post_import
 from app.tests.utils import get_server_api, IntValue
 from app.tests.api.v1.tests_configs import import_citizens_config as c
 
@@ -11,10 +13,7 @@ endpoint = "imports"
 
 
 def test_base_import():
-    server_api = get_server_api()
-    response = requests.post(f"{server_api}/{endpoint}", json=c.simple_import_data)
-    assert response.status_code == 200
-    assert response.json() == {"data": {"import_id": IntValue()}}
+    assert post_import(c.simple_import_data) == (200, IntValue())
 
 
 @pytest.mark.parametrize(
@@ -24,6 +23,7 @@ def test_base_import():
         ("inapropriate_gender", "gender", "transformer"),
         ("gender_incorrect_type", "gender", []),
         ("birth_date_incorrect_format", "birth_date", "228.14.88"),
+        ("birth_date_trailing_newline", "birth_date", "26.12.1986\n"),
         (
             "birth_date_greater_than_today",
             "birth_date",
@@ -36,14 +36,124 @@ def test_base_import():
         ("building_incorrect_type", "building", []),
         ("apartment_incorrect_type", "apartment", []),
         ("apartment_invalid_value", "apartment", -1),
+        ("apartment_not_a_number", "apartment", "7a"),
         ("name_incorrect_type", "name", []),
         ("relatives_wrong_type", "relatives", 420),
     ],
 )
 def test_wrong_cases(case_name, field, wrong_value):
-    server_api = get_server_api()
     citizen_to_import = c.citizen_template.copy()
     citizen_to_import[field] = wrong_value
     data = {"citizens": [citizen_to_import]}
-    response = requests.post(f"{server_api}/{endpoint}", json=data)
-    assert response.status_code == 400
+    assert post_import(data)[0] == 400
+
+
+def test_values_are_coerced_like_pydantic_does():
+    citizen_to_import = c.citizen_template.copy()
+    citizen_to_import.update(citizen_id="1", apartment=7.0, building=16, relatives=[])
+    status, import_id = post_import({"citizens": [citizen_to_import]})
+    assert status == 200
+    response = requests.get(f"{get_server_api()}/imports/{import_id}/citizens")
+    citizen = response.json()["data"][0]
+    assert (citizen["citizen_id"], citizen["apartment"]) == (1, 7)
+    assert citizen["building"] == "16"
+
+
+def _without_relatives(citizens):
+    for citizen in citizens:
+        citizen["relatives"] = []
+
+
+def _asymmetric_relatives(citizens):
+    citizens[0]["relatives"] = [citizens[1]["citizen_id"]]
+    citizens[1]["relatives"] = []
+
+
+def _duplicated_citizen_id(citizens):
+    _without_relatives(citizens)
+    citizens[1]["citizen_id"] = citizens[0]["citizen_id"]
+
+
+def _unknown_relative(citizens):
+    _without_relatives(citizens)
+    citizens[0]["relatives"] = [100500]
+
+
+def _self_relative(citizens):
+    _without_relatives(citizens)
+    citizens[0]["relatives"] = [citizens[0]["citizen_id"]]
+
+
+def _duplicated_relative(citizens):
+    _without_relatives(citizens)
+    citizens[0]["relatives"] = [citizens[1]["citizen_id"]] * 2
+    citizens[1]["relatives"] = [citizens[0]["citizen_id"]]
+
+
+@pytest.mark.parametrize(
+    "spoil",
+    [
+        _asymmetric_relatives,
+        _duplicated_citizen_id,
+        _unknown_relative,
+        _self_relative,
+        _duplicated_relative,
+    ],
+)
+def test_wrong_citizens_set(spoil):
+    data = deepcopy(c.simple_import_data)
+    spoil(data["citizens"])
+    assert post_import(data)[0] == 400
+
+
+@pytest.mark.parametrize("data", [[], {"citizens": {}}, {"citizens": [1]}, {}])
+def test_wrong_payload(data):
+    assert post_import(data)[0] == 400
+
+
+def import_once(data: dict, **headers) -> int:
+    status, import_id = post_import(data, **headers)
+    assert status == 200
+    return import_id
+
+
+def test_identical_import_is_deduplicated():
+    data = deepcopy(c.simple_import_data)
+    data["citizens"][0]["name"] = "Дубликатов Дубль"
+    import_id = import_once(data)
+    if import_once(data) != import_id:
+        pytest.skip("server runs without dedupe_imports")
+    data["citizens"].reverse()
+    assert import_once(data) == import_id
+
+    response = requests.patch(
+        f"{get_server_api()}/{endpoint}/{import_id}/citizens/1", json={"name": "Петров"}
+    )
+    assert response.status_code == 200
+    # the stored import no longer has that content
+    assert import_once(data) != import_id
+
+
+def test_idempotency_key():
+    data = deepcopy(c.simple_import_data)
+    data["citizens"][0]["name"] = "Ключев Ключ"
+    key = f"test-{date.today()}-{id(data)}"
+    import_id = import_once(data, **{"Idempotency-Key": key})
+    data["citizens"].reverse()
+    if import_once(data, **{"Idempotency-Key": key}) != import_id:
+        pytest.skip("server runs without dedupe_imports")
+    data["citizens"][0]["name"] = "Другой Ключ"
+    # a failed import job is answered 400 by post_import
+    assert post_import(data, **{"Idempotency-Key": key})[0] in (400, 422)
+    assert import_once(data, **{"Idempotency-Key": key + "-other"}) != import_id
+
+
+def test_openapi_documents_import_body():
+    server_api = get_server_api()
+    schema = requests.get(f"{server_api}/openapi.json").json()
+    body = schema["paths"]["/imports"]["post"]["requestBody"]["content"]
+    body_schema = body["application/json"]["schema"]
+    assert body_schema == {"$ref": "#/components/schemas/CitizensImportsIn"}
+    citizens = schema["components"]["schemas"]["CitizensImportsIn"]["properties"]
+    assert citizens["citizens"]["items"] == {"$ref": "#/components/schemas/CitizenIn"}
+    assert "birth_date" in schema["components"]["schemas"]["CitizenIn"]["properties"]
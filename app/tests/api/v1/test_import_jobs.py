@@ -0,0 +1,48 @@
+from copy import deepcopy
+
+import pytest
+import requests
+
+from app.tests.api_functions import wait_for_import_job
+from app.tests.utils import get_server_api
+from app.tests.api.v1.tests_configs import import_citizens_config as c
+
+
+endpoint = "imports/jobs/{job_id}"
+
+
+def post_import_job(data: dict) -> dict:
+    server_api = get_server_api()
+    response = requests.post(f"{server_api}/imports", json=data)
+    if response.status_code != 202:
+        pytest.skip("server runs imports synchronously")
+    return response.json()["data"]
+
+
+def test_import_job():
+    job = post_import_job(c.simple_import_data)
+    assert job["status"] == "validating"
+
+    job = wait_for_import_job(job["job_id"])
+    assert job["status"] == "done"
+    assert job["citizens_done"] == job["citizens_total"] == 3
+
+    server_api = get_server_api()
+    response = requests.get(f"{server_api}/imports/{job['import_id']}/citizens")
+    assert response.status_code == 200
+    assert len(response.json()["data"]) == 3
+
+
+def test_invalid_import_job():
+    data = deepcopy(c.simple_import_data)
+    data["citizens"][0]["relatives"] = []
+    job = wait_for_import_job(post_import_job(data)["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"]
+    assert job["import_id"] is None
+
+
+def test_unknown_job():
+    server_api = get_server_api()
+    response = requests.get(f"{server_api}/{endpoint.format(job_id=10 ** 9)}")
+    assert response.status_code == 404
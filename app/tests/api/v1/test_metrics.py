@@ -0,0 +1,46 @@
+from copy import deepcopy
+from datetime import datetime
+
+import pytest
+import requests
+
+from app.tests.utils import get_server_api
+from app.tests.api_functions import import_citizens
+from app.tests.api.v1.tests_configs import import_citizens_config as c
+
+
+def get_metrics() -> dict:
+    response = requests.get(f"{get_server_api()}/metrics")
+    if response.status_code == 404:
+        pytest.skip("server runs without metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics():
+    data = deepcopy(c.simple_import_data)
+    # not a retry of an earlier import, if the server deduplicates them
+    data["citizens"][0]["name"] = f"Метрик {datetime.utcnow().isoformat()}"
+    before = get_metrics()
+    import_id = import_citizens(data)
+    for _ in range(2):
+        requests.get(f"{get_server_api()}/imports/{import_id}/citizens/birthdays")
+    after = get_metrics()
+
+    def increase(name: str) -> float:
+        return after.get(name, 0) - before.get(name, 0)
+
+    route = 'method="GET",route="/imports/{import_id}/citizens/birthdays"'
+    assert increase(f"http_requests_total{{{route},status=\"200\"}}") == 2
+    assert increase(f"http_request_duration_seconds_count{{{route}}}") == 2
+    assert increase(f"http_response_size_bytes_count{{{route}}}") == 2
+    assert increase(f"http_response_size_bytes_sum{{{route}}}") > 0
+    assert increase("import_citizens_count") == 1
+    assert increase("import_citizens_sum") == len(data["citizens"])
+    assert increase("import_relation_edges_sum") == 1
@@ -77,3 +77,95 @@ def test_wrong_cases(case_name, field, wrong_value, import_fixture):
     )
 
     assert response.status_code == 400
+
+
+def test_get_citizens_after_update():
+    import_id = import_citizens(import_c.simple_import_data)
+    server_api = get_server_api()
+    citizens_endpoint = f"{server_api}/imports/{import_id}/citizens"
+    presents_endpoint = f"{citizens_endpoint}/birthdays"
+    requests.get(citizens_endpoint)
+    requests.get(presents_endpoint)
+
+    response = requests.patch(
+        f"{server_api}{endpoint.format(import_id=import_id, citizen_id=3)}",
+        json=c.update_data,
+    )
+    assert response.status_code == 200
+
+    gotten_citizens = requests.get(citizens_endpoint).json()["data"]
+    assert gotten_citizens[0]["relatives"] == [2, 3]
+    assert gotten_citizens[2] == response.json()["data"]
+    presents = requests.get(presents_endpoint).json()["data"]
+    assert presents["11"] == [{"citizen_id": 1, "presents": 1}]
+
+
+def test_bulk_update():
+    import_id = import_citizens(import_c.simple_import_data)
+    server_api = get_server_api()
+    citizens_endpoint = f"{server_api}/imports/{import_id}/citizens"
+    updates = [
+        {"citizen_id": 3, **c.update_data},
+        {"citizen_id": 1, "relatives": [3]},
+        {"citizen_id": 2, "apartment": 8},
+    ]
+
+    response = requests.patch(citizens_endpoint, json=updates)
+    assert response.status_code == 200
+    updated = response.json()["data"]
+    assert [citizen["citizen_id"] for citizen in updated] == [3, 1, 2]
+
+    gotten_citizens = requests.get(citizens_endpoint).json()["data"]
+    assert gotten_citizens[0]["relatives"] == [3]
+    assert gotten_citizens[1]["relatives"] == []
+    assert gotten_citizens[1]["apartment"] == 8
+    assert gotten_citizens[2] == updated[0]
+    assert gotten_citizens[2]["relatives"] == [1]
+
+
+def test_update_birth_date():
+    import_id = import_citizens(import_c.simple_import_data)
+    server_api = get_server_api()
+    citizens_endpoint = f"{server_api}/imports/{import_id}/citizens"
+    presents_endpoint = f"{citizens_endpoint}/birthdays"
+    assert requests.get(presents_endpoint).json()["data"]["4"] == [
+        {"citizen_id": 1, "presents": 1}
+    ]
+
+    response = requests.patch(
+        f"{server_api}{endpoint.format(import_id=import_id, citizen_id=2)}",
+        json={"birth_date": "17.06.1997"},
+    )
+    assert response.status_code == 200
+    assert response.json()["data"]["birth_date"] == "17.06.1997"
+    response = requests.patch(
+        citizens_endpoint, json=[{"citizen_id": 1, "birth_date": "26.02.1986"}]
+    )
+    assert response.status_code == 200
+    assert response.json()["data"][0]["birth_date"] == "26.02.1986"
+
+    presents = requests.get(presents_endpoint).json()["data"]
+    assert presents["4"] == [] and presents["12"] == []
+    assert presents["6"] == [{"citizen_id": 1, "presents": 1}]
+    assert presents["2"] == [{"citizen_id": 2, "presents": 1}]
+
+
+@pytest.mark.parametrize(
+    "updates, status_code",
+    [
+        ([{"citizen_id": 2, "apartment": 8}, {"citizen_id": 69, "name": "Иван"}], 404),
+        ([{"citizen_id": 2, "apartment": 8}, {"citizen_id": 1, "relatives": [69]}], 400),
+        ([{"citizen_id": 2, "apartment": 8}, {"citizen_id": 1, "relatives": [1]}], 400),
+        ([{"citizen_id": 2, "apartment": 8}, {"citizen_id": 1, "extra": 1}], 400),
+        ([{"apartment": 8}], 400),
+    ],
+)
+def test_bulk_update_wrong_cases(updates, status_code, import_fixture):
+    import_id = import_fixture
+    server_api = get_server_api()
+    citizens_endpoint = f"{server_api}/imports/{import_id}/citizens"
+    before = requests.get(citizens_endpoint).json()
+
+    response = requests.patch(citizens_endpoint, json=updates)
+    assert response.status_code == status_code
+    assert requests.get(citizens_endpoint).json() == before
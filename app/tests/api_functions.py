@@ -1,9 +1,37 @@
+import time
+from typing import Optional, Tuple
+
 import requests
 
 from app.tests.utils import get_server_api
 
 
-def import_citizens(import_data: dict) -> int:
+def wait_for_import_job(job_id: int, timeout: float = 10) -> dict:
+    server_api = get_server_api()
+    deadline = time.monotonic() + timeout
+    while True:
+        response = requests.get(f"{server_api}/imports/jobs/{job_id}")
+        assert response.status_code == 200
+        job = response.json()["data"]
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def post_import(import_data, **headers) -> Tuple[int, Optional[int]]:
+    # status code and import_id of POST /imports; with IMPORT_JOBS=1 the job
+    # is waited for, and its outcome given as the synchronous answer
     server_api = get_server_api()
-    response = requests.post(f"{server_api}/imports", json=import_data)
-    return response.json()["data"]["import_id"]
+    response = requests.post(f"{server_api}/imports", json=import_data, headers=headers)
+    if response.status_code == 202:
+        job = wait_for_import_job(response.json()["data"]["job_id"])
+        if job["status"] != "done":
+            return 400, None
+        return 200, job["import_id"]
+    if response.status_code != 200:
+        return response.status_code, None
+    return response.status_code, response.json()["data"]["import_id"]
+
+
+def import_citizens(import_data: dict) -> int:
+    return post_import(import_data)[1]
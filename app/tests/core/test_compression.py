@@ -0,0 +1,77 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.testclient import TestClient
+
+from app.core.compression import CompressionMiddleware, negotiate_encoding
+
+BODY = "Иванов Иван Иванович, Льва Толстого 16к7стр5; " * 2000
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = Starlette()
+    app.add_middleware(CompressionMiddleware, minimum_size=100, gzip_level=1)
+
+    @app.route("/big")
+    def big(request):
+        return PlainTextResponse(BODY)
+
+    @app.route("/small")
+    def small(request):
+        return PlainTextResponse("ok")
+
+    @app.route("/streamed")
+    def streamed(request):
+        async def chunks():
+            for _ in range(100):
+                yield BODY[:1000]
+
+        return StreamingResponse(chunks())
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("", None),
+        ("gzip", "gzip"),
+        ("deflate, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*, gzip;q=0", None),
+        ("identity", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, encoding):
+    assert negotiate_encoding(accept_encoding, ["gzip"]) == encoding
+
+
+def test_negotiate_encoding_prefers_the_first_supported():
+    assert negotiate_encoding("gzip, br", ["br", "gzip"]) == "br"
+    assert negotiate_encoding("gzip, br;q=0.9", ["br", "gzip"]) == "gzip"
+
+
+def test_big_response_is_compressed(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) < len(BODY.encode()) / 10
+    assert response.text == BODY
+
+
+@pytest.mark.parametrize(
+    "path, accept_encoding",
+    [("/small", "gzip"), ("/big", "identity"), ("/big", "gzip;q=0")],
+)
+def test_response_is_not_compressed(client, path, accept_encoding):
+    response = client.get(path, headers={"Accept-Encoding": accept_encoding})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streamed_response_is_compressed(client):
+    response = client.get("/streamed", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert response.text == BODY[:1000] * 100
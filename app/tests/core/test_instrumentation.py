@@ -0,0 +1,102 @@
+import contextvars
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from app.core.instrumentation import (
+    StackSampler,
+    handler_done,
+    instrument_engine,
+    phase,
+    start_request,
+)
+
+
+def in_new_context(func):
+    return contextvars.copy_context().run(func)
+
+
+def test_statements_are_counted_per_request():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+
+    def request(statements: int):
+        metrics = start_request()
+        for _ in range(statements):
+            engine.execute("SELECT 1")
+        return metrics
+
+    assert in_new_context(lambda: request(3)).statements == 3
+    assert in_new_context(lambda: request(0)).statements == 0
+    # outside of requests nothing is counted, and nothing fails
+    engine.execute("SELECT 1")
+
+
+def test_failed_statements_leave_nothing_behind():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+
+    def request():
+        metrics = start_request()
+        with engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.execute("SELECT * FROM missing")
+            connection.execute("SELECT 1")
+            started = connection.info["query_started"]
+        return metrics, started
+
+    metrics, started = in_new_context(request)
+    assert metrics.statements == 1
+    assert isinstance(started, float)
+
+
+def test_phases_and_server_timing():
+    def request():
+        metrics = start_request()
+        with phase("validation"):
+            time.sleep(0.01)
+        with phase("validation"):
+            pass
+        handler_done()
+        return metrics
+
+    metrics = in_new_context(request)
+    assert metrics.phases["validation"] >= 0.01
+    assert metrics.handler_done is not None
+    header = metrics.server_timing()
+    assert header.startswith('db;dur=0.0;desc="0 sql", validation;dur=')
+    assert "total;dur=" in header
+
+
+def test_phase_outside_of_requests():
+    with phase("validation"):
+        pass
+
+
+def test_sampler_folds_stacks_of_given_threads():
+    def slow_function(stop: threading.Event):
+        stop.wait()
+
+    stop = threading.Event()
+    thread = threading.Thread(target=slow_function, args=(stop,))
+    sampler = StackSampler(0.001)
+    started = time.perf_counter()
+    thread.start()
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    stop.set()
+    thread.join()
+
+    lines = sampler.folded({thread.ident}, started)
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    frames = stack.split(";")
+    assert frames[0].startswith("_bootstrap (threading.py")
+    assert any(frame.startswith("slow_function (") for frame in frames)
+    assert sampler.folded({thread.ident}, time.perf_counter()) == []
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from app.core.json_stream import (
+    MAX_ITEM_SIZE,
+    JSONArrayStream,
+    JSONStreamError,
+    iter_json_array,
+)
+from app.tests.api.v1.tests_configs import import_citizens_config as c
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_items_are_parsed_across_chunks(chunk_size, indent):
+    document = {"before": [{"citizens": "}"}], **c.simple_import_data, "after": 12345}
+    data = json.dumps(document, ensure_ascii=False, indent=indent).encode()
+    items = iter_json_array(chunked(data, chunk_size), "citizens")
+    assert list(items) == c.simple_import_data["citizens"]
+
+
+def test_numbers_are_not_cut_by_chunks():
+    data = b'{"citizens": [12345, 678]}'
+    assert list(iter_json_array(chunked(data, 16), "citizens")) == [12345, 678]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"[1]",
+        b'{"citizens": [1, 2}',
+        b'{"citizens": [1, 2]',
+        b'{"citizens": [1,]}',
+        b'{"citizens": [tru]}',
+        b'{"citizens": {}}',
+        b'{"citizens": []} []',
+        b'{"other": []}',
+        b'{"citizens": [1], "citizens": [2]}',
+        '{"citizens": ["ё"]}'.encode()[:-4],
+    ],
+)
+def test_invalid_documents(data):
+    with pytest.raises(JSONStreamError):
+        list(iter_json_array(chunked(data, 3), "citizens"))
+
+
+def test_other_values_are_not_limited():
+    large = "x" * 2 * MAX_ITEM_SIZE
+    data = json.dumps({"notes": [large], "citizens": [1, 2]}).encode()
+    assert list(iter_json_array(chunked(data, 4096), "citizens")) == [1, 2]
+
+
+def test_items_are_limited():
+    # an item is given up on before the end of the body
+    stream = JSONArrayStream("citizens")
+    data = json.dumps({"citizens": ["x" * 4 * MAX_ITEM_SIZE]}).encode()
+    with pytest.raises(JSONStreamError):
+        for chunk in chunked(data, 4096):
+            stream.feed(chunk)
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from starlette.responses import StreamingResponse
+
+from app.core.middleware import (
+    ConditionalGetMiddleware,
+    DBSessionMiddleware,
+    MetricsMiddleware,
+)
+
+CHUNKS = 200
+
+
+class FakeSession:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_streamed_body_waits_for_the_client():
+    produced, sessions = [], []
+
+    def chunks():
+        for i in range(CHUNKS):
+            produced.append(i)
+            yield b"x" * 1024
+
+    async def endpoint(scope, receive, send):
+        await StreamingResponse(chunks())(scope, receive, send)
+
+    def new_session():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    # the same nesting as in app.main
+    app = ConditionalGetMiddleware(
+        endpoint, get_import_state=lambda db, import_id: (3, datetime(2000, 1, 1))
+    )
+    app = DBSessionMiddleware(app, session_factory=new_session, instrumented=True)
+    app = MetricsMiddleware(app, route_of=lambda scope: "/imports/{import_id}/citizens")
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/imports/1/citizens",
+        "headers": [],
+        "query_string": b"",
+    }
+    messages, ahead = [], []
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def slow_client(message):
+        messages.append(message)
+        if message["type"] == "http.response.body":
+            # chunks produced but not sent to the client yet
+            ahead.append(len(produced) - (len(messages) - 1))
+            await asyncio.sleep(0.001)
+
+    asyncio.get_event_loop().run_until_complete(app(scope, receive, slow_client))
+
+    start = messages[0]
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    assert start["status"] == 200
+    assert headers["etag"] == 'W/"1-3"'
+    assert "server-timing" in headers
+    assert sum(len(m.get("body", b"")) for m in messages[1:]) == CHUNKS * 1024
+    # starlette's BaseHTTPMiddleware would have the whole body queued
+    assert max(ahead) <= 2
+    assert sessions[0].closed
+
+
+def test_not_modified():
+    async def endpoint(scope, receive, send):
+        raise AssertionError("a 304 doesn't reach the endpoint")
+
+    updated_at = datetime.utcnow() - timedelta(days=1)
+    app = ConditionalGetMiddleware(
+        endpoint, get_import_state=lambda db, import_id: (3, updated_at)
+    )
+    app = DBSessionMiddleware(app, session_factory=FakeSession)
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/imports/1/citizens",
+        "headers": [(b"if-none-match", b'W/"1-3"')],
+        "query_string": b"",
+    }
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.get_event_loop().run_until_complete(app(scope, None, send))
+    assert messages[0]["status"] == 304
@@ -0,0 +1,107 @@
+from copy import deepcopy
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.crud.citizen import import_users
+from app.crud.import_digest import (
+    IdempotencyKeyReusedError,
+    KeyContent,
+    content_digest,
+    find_import,
+    import_once,
+    key_digest,
+    request_digests,
+)
+from app.db.init_db import init_db
+from app.db_models.citizen import Import
+from app.models.citizen import validate_citizens_import
+from app.tests.api.v1.tests_configs import import_citizens_config as c
+
+
+@pytest.fixture()
+def db():
+    engine = create_engine("sqlite://")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+def validated(payload: dict):
+    return validate_citizens_import(deepcopy(payload))
+
+
+def test_content_digest_ignores_order():
+    reordered = deepcopy(c.simple_import_data)
+    reordered["citizens"].reverse()
+    for citizen in reordered["citizens"]:
+        citizen["relatives"].reverse()
+    changed = deepcopy(c.simple_import_data)
+    changed["citizens"][0]["apartment"] += 1
+
+    digest = content_digest(validated(c.simple_import_data))
+    assert content_digest(validated(reordered)) == digest
+    assert content_digest(validated(changed)) != digest
+
+    key_content = KeyContent(validated(c.simple_import_data)).hexdigest()
+    streamed = KeyContent()
+    for citizen in validated(reordered):
+        streamed.add([citizen])
+    assert streamed.hexdigest() == key_content
+    assert KeyContent(validated(changed)).hexdigest() != key_content
+
+
+def test_import_once(db):
+    writes = []
+
+    def write(payload):
+        def import_payload():
+            writes.append(payload)
+            return import_users(db, validated(payload))
+
+        return import_payload
+
+    def key_content(payload):
+        return lambda: KeyContent(validated(payload)).hexdigest()
+
+    simple = key_content(c.simple_import_data)
+    digests = request_digests(validated(c.simple_import_data), "retry-1")
+    first = import_once(db, digests, write(c.simple_import_data), simple)
+    again = import_once(db, digests, write(c.simple_import_data), simple)
+    assert again.import_id == first.import_id
+    # the key alone finds it
+    assert find_import(db, [key_digest("retry-1")], simple) == first.import_id
+    assert len(writes) == 1
+
+    # a changed import matches its key, not its former content
+    db.query(Import).update({Import.version: Import.version + 1})
+    db.commit()
+    assert find_import(db, [key_digest("retry-1")], simple) == first.import_id
+    content = request_digests(validated(c.simple_import_data), None)
+    assert find_import(db, content, simple) is None
+    second = import_once(db, content, write(c.simple_import_data))
+    assert second.import_id != first.import_id
+    assert find_import(db, content, simple) == second.import_id
+    assert len(writes) == 2
+
+
+def test_reused_key(db):
+    changed = deepcopy(c.simple_import_data)
+    changed["citizens"][0]["apartment"] += 1
+
+    def key_content(payload):
+        return lambda: KeyContent(validated(payload)).hexdigest()
+
+    digests = [key_digest("retry-2")]
+    first = import_once(
+        db,
+        digests,
+        lambda: import_users(db, validated(c.simple_import_data)),
+        key_content(c.simple_import_data),
+    )
+    found = find_import(db, digests, key_content(c.simple_import_data))
+    assert found == first.import_id
+    with pytest.raises(IdempotencyKeyReusedError):
+        find_import(db, digests, key_content(changed))
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.crud.import_job import (
+    create_import_job,
+    fail_abandoned_import_jobs,
+    get_import_job,
+    set_import_job_progress,
+    update_import_job,
+)
+from app.db.init_db import init_db
+
+
+@pytest.fixture()
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+def test_progress_is_committed_at_once(db):
+    job_id = create_import_job(db, "host:1").job_id
+    set_import_job_progress(db.bind, job_id, 5000)
+    other = sessionmaker(bind=db.bind)()
+    assert get_import_job(other, job_id).citizens_done == 5000
+    other.close()
+
+
+def test_abandoned_jobs_are_failed(db):
+    running = create_import_job(db, "host:1").job_id
+    stopped = create_import_job(db, "host:2").job_id
+    importing = create_import_job(db, "host:2").job_id
+    update_import_job(db, importing, status="importing")
+    done = create_import_job(db, "host:2").job_id
+    update_import_job(db, done, status="done")
+
+    assert fail_abandoned_import_jobs(db, lambda worker: worker == "host:1") == 2
+    statuses = {
+        job_id: get_import_job(db, job_id).status
+        for job_id in (running, stopped, importing, done)
+    }
+    assert statuses == {
+        running: "validating",
+        stopped: "failed",
+        importing: "failed",
+        done: "done",
+    }
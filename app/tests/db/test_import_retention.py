@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.cache import import_cache
+from app.crud.citizen import get_citizens_data, get_import_version, import_users
+from app.crud.import_retention import (
+    delete_import,
+    expire_imports,
+    is_deleted_import,
+    purge_import_batch,
+    reclaim_space,
+)
+from app.db.init_db import init_db
+from app.db_models.citizen import Citizen, Import, Presents, Relations
+from app.models.citizen import validate_citizens_import
+
+CITIZENS = 300
+
+
+@pytest.fixture()
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'retention.db'}")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+def new_import(db) -> int:
+    payload = {"citizens": generate_citizens_data(CITIZENS, 4)}
+    import_id = import_users(db, validate_citizens_import(payload)).import_id
+    # ids repeat across the dbs of test modules
+    import_cache.invalidate(import_id)
+    return import_id
+
+
+def rows(db, import_id: int) -> int:
+    return sum(
+        db.query(func.count()).filter(model.import_id == import_id).scalar()
+        for model in (Citizen, Relations, Presents)
+    )
+
+
+def test_purge_in_batches(db):
+    kept, deleted = new_import(db), new_import(db)
+    kept_data = get_citizens_data(db, kept)
+    total = rows(db, deleted)
+
+    assert delete_import(db, deleted)
+    assert not delete_import(db, deleted)
+    assert is_deleted_import(db, deleted)
+    assert get_import_version(db, deleted) is None
+
+    batches = []
+    while True:
+        purged = purge_import_batch(db, 100)
+        if purged is None:
+            break
+        batches.append(purged)
+    assert max(batches) <= 100
+    # the last batch is the import row
+    assert sum(batches) == total + 1
+    assert rows(db, deleted) == 0
+    assert db.query(Import).filter(Import.import_id == deleted).count() == 0
+    assert get_citizens_data(db, kept) == kept_data
+
+
+def test_expire_imports(db):
+    old, new = new_import(db), new_import(db)
+    db.query(Import).filter(Import.import_id == old).update(
+        {Import.created_at: datetime.utcnow() - timedelta(days=10)}
+    )
+    db.commit()
+    assert expire_imports(db, timedelta(days=7)) == 1
+    assert is_deleted_import(db, old)
+    assert not is_deleted_import(db, new)
+
+
+def test_reclaim_space(db):
+    import_ids = [new_import(db) for _ in range(3)]
+    path = db.bind.url.database
+    size = os.path.getsize(path)
+    for import_id in import_ids:
+        delete_import(db, import_id)
+    while purge_import_batch(db, 10000) is not None:
+        pass
+    assert os.path.getsize(path) == size
+    while reclaim_space(db, 10):
+        pass
+    assert os.path.getsize(path) < size / 2
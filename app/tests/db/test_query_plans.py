@@ -0,0 +1,112 @@
+from copy import deepcopy
+from typing import Callable, List, Tuple
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    import_users,
+    get_citizen,
+    get_citizens_data,
+    iter_citizens_data,
+    get_citizens_presents,
+    get_age_stats_by_town,
+    update_citizen,
+)
+from app.db.init_db import init_db
+from app.models.citizen import CitizenUpdateIn, validate_citizens_import
+from app.tests.api.v1.tests_configs import import_citizens_config as import_c
+from app.tests.api.v1.tests_configs import update_citizen_info_config as update_c
+
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def import_id(db):
+    citizens = validate_citizens_import(deepcopy(import_c.simple_import_data))
+    return import_users(db, citizens).import_id
+
+
+def query_plans(db: Session, run: Callable) -> List[Tuple[str, List[str]]]:
+    statements = []
+
+    def collect_select(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(db.bind, "before_cursor_execute", collect_select)
+    try:
+        run()
+    finally:
+        event.remove(db.bind, "before_cursor_execute", collect_select)
+
+    connection = db.connection()
+    return [
+        (
+            statement,
+            [
+                row[-1]
+                for row in connection.execute(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters
+                )
+            ],
+        )
+        for statement, parameters in statements
+    ]
+
+
+def assert_no_full_scans(plans: List[Tuple[str, List[str]]]):
+    assert plans
+    for statement, plan in plans:
+        for detail in plan:
+            assert not detail.startswith("SCAN"), f"{detail} in {statement}"
+
+
+@pytest.mark.parametrize(
+    "read",
+    [
+        get_citizens_data,
+        lambda db, import_id: list(iter_citizens_data(db, import_id)),
+        get_citizens_presents,
+        get_age_stats_by_town,
+    ],
+)
+def test_reads_use_indexes(db, import_id, read):
+    import_cache.invalidate(import_id)
+    assert_no_full_scans(query_plans(db, lambda: read(db, import_id)))
+
+
+def test_age_stats_are_read_from_covering_index(db, import_id):
+    import_cache.invalidate(import_id)
+    plans = query_plans(db, lambda: get_age_stats_by_town(db, import_id))
+    details = [detail for _, plan in plans for detail in plan]
+    assert any("COVERING INDEX ix_citizen_import_id_town_birth_date" in d for d in details)
+    assert not any("TEMP B-TREE" in d for d in details)
+
+
+def test_update_uses_indexes(db, import_id):
+    update_model = CitizenUpdateIn(**update_c.update_data)
+
+    def update():
+        update_citizen(db, get_citizen(db, import_id, 3), update_model)
+
+    assert_no_full_scans(query_plans(db, update))
+
+
+def test_update_reads_presents_by_citizen(db, import_id):
+    update_model = CitizenUpdateIn(**update_c.update_data)
+
+    def update():
+        update_citizen(db, get_citizen(db, import_id, 3), update_model)
+
+    details = [detail for _, plan in query_plans(db, update) for detail in plan]
+    assert any("ix_presents_import_id_citizen_id" in d for d in details)
@@ -0,0 +1,213 @@
+import pytest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    get_citizen,
+    get_citizens_data,
+    get_citizens_presents,
+    get_import_version,
+    import_users,
+    import_users_in_batches,
+    update_citizens,
+)
+from app.crud.import_retention import (
+    delete_import,
+    is_deleted_import,
+    purge_import_batch,
+)
+from app.db.init_db import init_db
+from app.db.shards import (
+    ShardedSession,
+    ShardRouter,
+    imports_in_main_db,
+    route_to_import,
+)
+from app.db_models.citizen import Citizen, Import
+from app.models.citizen import CitizenBulkUpdateIn, validate_citizens_import
+
+CITIZENS = 100
+
+
+@pytest.fixture()
+def shards(tmp_path):
+    shards = ShardRouter(str(tmp_path / "shards"), create_engine)
+    shards.init()
+    return shards
+
+
+@pytest.fixture()
+def main_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    init_db(engine)
+    return engine
+
+
+@pytest.fixture()
+def new_session(shards, main_engine):
+    autocommit_engine = create_engine(
+        main_engine.url, connect_args={"isolation_level": None}
+    )
+    return sessionmaker(
+        class_=ShardedSession,
+        shards=shards,
+        main_bind=autocommit_engine,
+        autocommit=False,
+        autoflush=False,
+        bind=main_engine,
+    )
+
+
+def new_import(db) -> int:
+    payload = {"citizens": generate_citizens_data(CITIZENS, 4)}
+    import_id = import_users(db, validate_citizens_import(payload)).import_id
+    # ids repeat across the dbs of test modules
+    import_cache.invalidate(import_id)
+    return import_id
+
+
+def citizen_rows(engine: Engine) -> int:
+    count = select([func.count()]).select_from(Citizen.__table__)
+    return engine.execute(count).scalar()
+
+
+def test_import_rows_go_to_its_file(shards, main_engine, new_session):
+    writer = new_session()
+    first, second = new_import(writer), new_import(writer)
+    writer.close()
+    assert shards.exists(first) and shards.exists(second)
+    assert citizen_rows(main_engine) == 0
+
+    for import_id in (first, second):
+        db = new_session()
+        route_to_import(db, import_id)
+        assert len(get_citizens_data(db, import_id)) == CITIZENS
+        assert get_citizens_presents(db, import_id)
+        assert get_import_version(db, import_id) == 0
+        assert citizen_rows(shards.engine(import_id)) == CITIZENS
+        db.close()
+
+
+def test_missing_import_reads_empty(shards, new_session):
+    db = new_session()
+    route_to_import(db, 404)
+    assert get_citizen(db, 404, 1) is None
+    assert get_citizens_data(db, 404) == []
+    assert not shards.exists(404)
+    db.close()
+
+
+def test_update_citizens(new_session):
+    db = new_session()
+    import_id = new_import(db)
+    route_to_import(db, import_id)
+    update = CitizenBulkUpdateIn(citizen_id=1, name="Renamed")
+    assert update_citizens(db, import_id, [update])[0]["name"] == "Renamed"
+    db.close()
+
+    db = new_session()
+    route_to_import(db, import_id)
+    assert get_citizen(db, import_id, 1).name == "Renamed"
+    assert get_import_version(db, import_id) == 1
+    db.close()
+
+
+def test_failed_import_is_purged(shards, new_session):
+    def batches():
+        payload = {"citizens": generate_citizens_data(CITIZENS, 0)}
+        yield validate_citizens_import(payload), []
+        raise ValueError("invalid batch")
+
+    db = new_session()
+    with pytest.raises(ValueError):
+        import_users_in_batches(db, batches())
+    import_id = db.query(func.max(Import.import_id)).scalar()
+    assert is_deleted_import(db, import_id)
+    assert shards.exists(import_id)
+
+    assert purge_import_batch(db, 10) == 1
+    assert purge_import_batch(db, 10) is None
+    assert not shards.exists(import_id)
+    db.close()
+
+
+def test_delete_import_unlinks_its_file(shards, new_session):
+    db = new_session()
+    kept, deleted = new_import(db), new_import(db)
+    assert delete_import(db, deleted)
+    assert purge_import_batch(db, 10) == 1
+    assert not shards.exists(deleted)
+    assert db.query(Import).filter(Import.import_id == deleted).count() == 0
+    route_to_import(db, kept)
+    assert len(get_citizens_data(db, kept)) == CITIZENS
+    db.close()
+
+
+def test_version_is_kept_with_rows(shards, new_session):
+    db = new_session()
+    import_id = new_import(db)
+    route_to_import(db, import_id)
+    update_citizens(db, import_id, [CitizenBulkUpdateIn(citizen_id=1, name="Renamed")])
+    main_version = db.query(Import.version).filter(Import.import_id == import_id)
+    assert get_import_version(db, import_id) == main_version.scalar() == 1
+    db.close()
+
+    db = new_session()
+    route_to_import(db, import_id)
+
+    def crash(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE shardversion"):
+            raise RuntimeError("crash")
+
+    # the rows' transaction fails after the import row is bumped
+    event.listen(shards.engine(import_id), "before_cursor_execute", crash)
+    with pytest.raises(RuntimeError):
+        update = CitizenBulkUpdateIn(citizen_id=1, name="Lost")
+        update_citizens(db, import_id, [update])
+    db.rollback()
+    event.remove(shards.engine(import_id), "before_cursor_execute", crash)
+    # content digests no longer match, ETags and caches still go by the rows
+    assert main_version.with_session(db).scalar() == 2
+    assert get_import_version(db, import_id) == 1
+    assert get_citizen(db, import_id, 1).name == "Renamed"
+    db.close()
+
+
+def test_imports_stored_before_shards(shards, main_engine, new_session):
+    plain = sessionmaker(autocommit=False, autoflush=False, bind=main_engine)()
+    before = new_import(plain)
+    plain.close()
+    shards.init(imports_in_main_db(main_engine))
+    assert shards.main_db_imports == {before}
+
+    db = new_session()
+    after = new_import(db)
+    assert not shards.exists(before) and shards.exists(after)
+    route_to_import(db, before)
+    assert len(get_citizens_data(db, before)) == CITIZENS
+    update = CitizenBulkUpdateIn(citizen_id=1, name="Renamed")
+    assert update_citizens(db, before, [update])[0]["name"] == "Renamed"
+    assert get_import_version(db, before) == 1
+    db.close()
+
+    db = new_session()
+    assert delete_import(db, before)
+    batches = 0
+    while purge_import_batch(db, 100) is not None:
+        batches += 1
+    # citizens, relations and presents in batches, then the import row
+    assert batches > 3
+    assert citizen_rows(main_engine) == 0
+    assert db.query(Import).filter(Import.import_id == before).count() == 0
+    assert shards.main_db_imports == set()
+    route_to_import(db, after)
+    assert len(get_citizens_data(db, after)) == CITIZENS
+    db.close()
+    # other workers still list the purged import, its id reused by a new
+    # import has a file
+    shards.main_db_imports.add(before)
+    shards.create(before)
+    assert not shards.in_main_db(before)
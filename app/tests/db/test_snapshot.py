@@ -0,0 +1,85 @@
+import json
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core import config
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    SNAPSHOT_KEY,
+    get_age_stats_by_town,
+    get_citizens_data,
+    get_citizens_presents,
+    get_import_version,
+    import_users,
+    update_citizens,
+)
+from app.crud.snapshot import ImportSnapshot, get_import_snapshot
+from app.db.init_db import init_db
+from app.models.citizen import CitizenBulkUpdateIn, validate_citizens_import
+from app.tests.db.test_update_citizens import random_updates
+
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def snapshot_reads(monkeypatch):
+    monkeypatch.setattr(config, "snapshot_reads", True)
+
+
+def assert_same_as_db(db, import_id: int, snapshot: ImportSnapshot):
+    import_cache.invalidate(import_id)
+    citizens = get_citizens_data(db, import_id)
+    for citizen in citizens:
+        citizen["birth_date"] = citizen["birth_date"].strftime("%d.%m.%Y")
+        citizen["relatives"] = sorted(citizen["relatives"])
+    assert json.loads(snapshot.citizens_json()) == {"data": citizens}
+    assert snapshot.presents() == get_citizens_presents(db, import_id)
+    assert snapshot.age_stats() == get_age_stats_by_town(db, import_id)
+
+
+def test_snapshot_is_the_same_as_db(db):
+    payload = {"citizens": generate_citizens_data(200, 4, towns=10, seed=2)}
+    import_id = import_users(db, validate_citizens_import(payload)).import_id
+    import_cache.invalidate(import_id)
+    assert_same_as_db(db, import_id, ImportSnapshot.load(db, import_id))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_snapshot_is_patched(db, snapshot_reads, seed):
+    payload = {"citizens": generate_citizens_data(40, 3, towns=5, seed=1)}
+    import_id = import_users(db, validate_citizens_import(payload)).import_id
+    import_cache.invalidate(import_id)
+    snapshot = get_import_snapshot(db, import_id)
+
+    rnd = random.Random(seed)
+    for _ in range(5):
+        updates = random_updates(rnd, 5)
+        for update in updates:
+            if rnd.random() < 0.3:
+                update["town"] = f"Город {rnd.randint(0, 7)}"
+        update_citizens(
+            db, import_id, [CitizenBulkUpdateIn(**u) for u in updates]
+        )
+        version = get_import_version(db, import_id)
+        found, patched = import_cache.get(import_id, SNAPSHOT_KEY, version)
+        assert found and patched is not snapshot
+        snapshot = patched
+    assert_same_as_db(db, import_id, snapshot)
+
+
+def test_empty_snapshot(db):
+    snapshot = ImportSnapshot.load(db, 10 ** 9)
+    assert json.loads(snapshot.citizens_json()) == {"data": []}
+    assert snapshot.presents() == {str(month): [] for month in range(1, 13)}
+    assert snapshot.age_stats() == []
@@ -0,0 +1,173 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.benchmarks.datagen import generate_citizens_data
+from app.core.cache import import_cache
+from app.crud.citizen import (
+    IN_CHUNK_SIZE,
+    CitizenNotFoundError,
+    get_citizen,
+    get_citizens_data,
+    get_citizens_presents,
+    import_users,
+    update_citizen,
+    update_citizens,
+)
+from app.crud.presents import presents_select
+from app.db.init_db import init_db
+from app.models.citizen import (
+    CitizenBulkUpdateIn,
+    CitizenUpdateError,
+    CitizenUpdateIn,
+    validate_citizens_import,
+)
+
+CITIZENS = 40
+
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    init_db(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+def new_import(db) -> int:
+    payload = {"citizens": generate_citizens_data(CITIZENS, 3, towns=5, seed=1)}
+    import_id = import_users(db, validate_citizens_import(payload)).import_id
+    # ids repeat across the in-memory dbs of test modules
+    import_cache.invalidate(import_id)
+    return import_id
+
+
+def random_updates(rnd: random.Random, count: int):
+    updates = []
+    for _ in range(count):
+        citizen_id = rnd.randint(1, CITIZENS)
+        update = {"citizen_id": citizen_id}
+        if rnd.random() < 0.5:
+            update["name"] = f"Иванов {rnd.randint(0, 1000)}"
+        if rnd.random() < 0.5:
+            update["birth_date"] = f"01.{rnd.randint(1, 12):02d}.1990"
+        if rnd.random() < 0.7:
+            others = [i for i in range(1, CITIZENS + 1) if i != citizen_id]
+            update["relatives"] = rnd.sample(others, rnd.randint(0, 4))
+        updates.append(update)
+    return updates
+
+
+def presents_rows(db, import_id: int):
+    return sorted(
+        (row.citizen_id, row.month, row.count)
+        for row in db.execute(presents_select(import_id))
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bulk_update_is_the_same_as_sequential(db, seed):
+    updates = random_updates(random.Random(seed), 30)
+    sequential_id, bulk_id = new_import(db), new_import(db)
+
+    for update in updates:
+        fields = {k: v for k, v in update.items() if k != "citizen_id"}
+        update_citizen(
+            db,
+            get_citizen(db, sequential_id, update["citizen_id"]),
+            CitizenUpdateIn(**fields),
+        )
+    updated = update_citizens(
+        db,
+        bulk_id,
+        [CitizenBulkUpdateIn(**update) for update in updates],
+    )
+
+    sequential = get_citizens_data(db, sequential_id)
+    for citizen in sequential:
+        citizen["relatives"] = sorted(citizen["relatives"])
+    assert get_citizens_data(db, bulk_id) == sequential
+    by_id = {citizen["citizen_id"]: citizen for citizen in sequential}
+    assert updated == [by_id[citizen["citizen_id"]] for citizen in updated]
+
+    assert get_citizens_presents(db, bulk_id) == get_citizens_presents(
+        db, sequential_id
+    )
+    presents = [
+        (citizen["citizen_id"], int(month), citizen["presents"])
+        for month, citizens in get_citizens_presents(db, bulk_id).items()
+        for citizen in citizens
+    ]
+    assert sorted(presents) == presents_rows(db, bulk_id)
+
+
+@pytest.mark.parametrize(
+    "update, error",
+    [
+        ({"citizen_id": CITIZENS + 1, "name": "Иванов"}, CitizenNotFoundError),
+        ({"citizen_id": 1, "relatives": [CITIZENS + 1]}, CitizenUpdateError),
+        ({"citizen_id": 1, "relatives": [1]}, CitizenUpdateError),
+    ],
+)
+def test_bulk_update_is_atomic(db, update, error):
+    import_id = new_import(db)
+    before = get_citizens_data(db, import_id)
+    updates = [{"citizen_id": 2, "name": "Петров", "relatives": []}, update]
+    with pytest.raises(error):
+        update_citizens(
+            db, import_id, [CitizenBulkUpdateIn(**u) for u in updates]
+        )
+    db.rollback()
+    assert get_citizens_data(db, import_id) == before
+
+
+def count_statements(db, run) -> int:
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.bind, "before_cursor_execute", collect)
+    try:
+        run()
+    finally:
+        event.remove(db.bind, "before_cursor_execute", collect)
+    return len(statements)
+
+
+@pytest.mark.parametrize(
+    "relatives_before, relatives_after",
+    [
+        (lambda k: [], lambda k: list(range(2, k + 2))),
+        (lambda k: list(range(2, k + 2)), lambda k: []),
+        (lambda k: list(range(2, k + 2)), lambda k: list(range(k + 2, 2 * k + 2))),
+    ],
+    ids=["add", "remove", "replace"],
+)
+def test_update_queries_dont_depend_on_relatives(db, relatives_before, relatives_after):
+    # same birth month for everyone, so presents change the same way
+    # whatever the number of relatives is
+    citizens = generate_citizens_data(2100, 0)
+    for citizen in citizens:
+        citizen["birth_date"] = "01.01.1990"
+    db_import = import_users(db, validate_citizens_import({"citizens": citizens}))
+
+    def patch(relatives):
+        citizen = get_citizen(db, db_import.import_id, 1)
+        update_citizen(db, citizen, CitizenUpdateIn(relatives=relatives))
+        return citizen.relatives
+
+    statements = {}
+    for k in (1, 200, 1000):
+        patch(relatives_before(k))
+        statements[k] = count_statements(db, lambda: patch(relatives_after(k)))
+    # an executemany is counted once, the driver sends all of its rows
+    # in one call; up to a chunk of relatives the count is constant,
+    # past it the lookups of relatives and presents and the two relation
+    # DELETEs take a statement per chunk each
+    assert statements[1] == statements[200]
+    extra_chunks = -(-1000 // (IN_CHUNK_SIZE // 2)) - 1
+    assert statements[1] < statements[1000] <= statements[1] + 4 * extra_chunks